@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for spikertools
+
+Times and measures the peak memory of the main Session and Channel operations on synthetic recordings
+(see spikertools.synthetic_recording) of increasing length, so that performance changes can be quantified.
+
+Usage:
+    python benchmarks.py                                   #10 s, 1 min and 10 min recordings
+    python benchmarks.py --sizes 60 3600 --channels 4      #1 min and 1 hour recordings with 4 channels
+    python benchmarks.py --ops filt decim --output new.json --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+import matplotlib.pyplot as plt
+import spikertools as st
+
+#opens a Session of the recording without the status messages printed for every channel
+def open_session(paths, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return st.Session(paths[0], paths[1], **kwargs)
+
+#each benchmark takes the (datapath, eventspath) of a recording, does its setup, and returns the function that is measured
+def bench_load(paths):
+    return lambda: open_session(paths)
+
+def bench_load_mmap(paths):
+    return lambda: open_session(paths, mmap = True).get_channeldata()[..., -1]
+
+def bench_filt(paths):
+    session = open_session(paths)
+    return lambda: session.pipeline().filt(300, 'hp').filt(60, 'n').filt(3000, 'lp').apply()
+
+def bench_filt_chunked(paths):
+    session = open_session(paths)
+    return lambda: session.pipeline().filt(300, 'hp').filt(60, 'n').filt(3000, 'lp').apply(chunk_size = 2**18)
+
+def bench_filt_float32(paths):
+    session = open_session(paths, dtype = np.float32)
+    return lambda: session.pipeline().filt(300, 'hp').filt(60, 'n').filt(3000, 'lp').apply()
+
+def bench_decim(paths):
+    session = open_session(paths)
+    return lambda: session._decim(4)
+
+def bench_normalize(paths):
+    session = open_session(paths)
+    return lambda: (session._normalize('mean'), session._normalize('std'))
+
+def bench_detect_spikes(paths):
+    session = open_session(paths)
+    return lambda: session._detect_spikes()
+
+def bench_event_average(paths):
+    session = open_session(paths)
+    return lambda: session.event_average('1', 0.1, 0.5)
+
+def bench_tlavgplot(paths):
+    session = open_session(paths)
+    return lambda: session.tlavgplot('1', 0.1, 0.5)
+
+def bench_plot_overview(paths):
+    session = open_session(paths)
+    return lambda: session.plot_overview()
+
+def bench_psd(paths):
+    session = open_session(paths)
+    return lambda: session.compute_psd()
+
+def bench_spectrogram(paths):
+    session = open_session(paths)
+    return lambda: session.compute_spectrogram()
+
+def bench_spectrum(paths):
+    session = open_session(paths)
+    return lambda: session.compute_spectrum()
+
+def bench_coherence(paths):
+    session = open_session(paths)
+    return lambda: session.compute_coherence(nperseg = 1024)
+
+def bench_xcorr(paths):
+    session = open_session(paths)
+    return lambda: session.compute_xcorr(max_lag = 0.01)
+
+BENCHMARKS = {
+    'load': bench_load,
+    'load_mmap': bench_load_mmap,
+    'filt': bench_filt,
+    'filt_chunked': bench_filt_chunked,
+    'filt_float32': bench_filt_float32,
+    'decim': bench_decim,
+    'normalize': bench_normalize,
+    'detect_spikes': bench_detect_spikes,
+    'event_average': bench_event_average,
+    'tlavgplot': bench_tlavgplot,
+    'plot_overview': bench_plot_overview,
+    'psd': bench_psd,
+    'spectrogram': bench_spectrogram,
+    'spectrum': bench_spectrum,
+    'coherence': bench_coherence,
+    'xcorr': bench_xcorr,
+}
+
+def measure(benchmark, paths, repeat = 3):
+    '''
+    Measure one benchmark on one recording.
+    The time is the best of repeat runs, each with a fresh setup; the peak memory is measured with tracemalloc
+    in a separate run, so that tracing does not slow down the timed runs. Setup is excluded from both.
+
+    Return:
+    (time in seconds, peak memory allocated during the run in bytes)
+    '''
+    times = []
+    for i in range(repeat):
+        run = benchmark(paths)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        times.append(time.perf_counter() - start)
+        plt.close('all')
+        del run
+    run = benchmark(paths)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plt.close('all')
+    return min(times), peak
+
+def measure_import(repeat = 3):
+    '''
+    Measure the cold start of a batch worker: the time for a new Python process to import spikertools (numpy included),
+    best of repeat processes.
+
+    Return:
+    (time in seconds to import numpy, time in seconds to import spikertools after numpy)
+    '''
+    script = ("import time; start = time.perf_counter(); import numpy; middle = time.perf_counter(); import spikertools; "
+              "print(middle - start, time.perf_counter() - middle)")
+    times = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                capture_output = True, text = True, check = True).stdout
+        times.append(tuple(float(value) for value in output.split()))
+    return min(times, key = sum)
+
+def recording(directory, duration, nchannels, fs, seed):
+    '''
+    Returns the paths of a synthetic recording, generating it unless a recording with the same settings is in directory.
+    '''
+    datapath = os.path.join(directory, f"BYB_Recording_synthetic_{duration:g}s_{nchannels}ch_{fs}Hz_seed{seed}.wav")
+    if not (os.path.exists(datapath) and os.path.exists(datapath[:-4] + '-events.txt')):
+        st.synthetic_recording(datapath, duration, nchannels, fs, seed = seed)
+    return datapath, datapath[:-4] + '-events.txt'
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark spikertools on synthetic recordings.")
+    parser.add_argument('--sizes', type = float, nargs = '+', default = [10, 60, 600], help = "recording durations in seconds")
+    parser.add_argument('--channels', type = int, default = 2, help = "number of channels")
+    parser.add_argument('--fs', type = int, default = 10000, help = "sampling rate in Hz")
+    parser.add_argument('--ops', nargs = '+', default = list(BENCHMARKS), choices = list(BENCHMARKS), help = "operations to benchmark")
+    parser.add_argument('--repeat', type = int, default = 3, help = "timed runs per operation, the best is reported")
+    parser.add_argument('--seed', type = int, default = 0, help = "seed of the synthetic recordings")
+    parser.add_argument('--data-dir', default = None, help = "directory where recordings are generated and reused (default: a temporary directory)")
+    parser.add_argument('--output', default = None, help = "write the results to this JSON file")
+    parser.add_argument('--compare', default = None, help = "JSON file of earlier results to compare against")
+    args = parser.parse_args()
+
+    numpy_time, import_time = measure_import(args.repeat)
+    print(f"import: numpy {numpy_time*1e3:.1f} ms, spikertools {import_time*1e3:.1f} ms")
+    #scipy and matplotlib are imported on first use (see spikertools._LazyModule); that one-time cost is kept out of the timings
+    st.signal.sosfilt, st.wavfile.read, st.plt.figure
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = {(row['duration'], row['op']): row for row in json.load(baseline_file)['results']}
+
+    with contextlib.ExitStack() as stack:
+        directory = args.data_dir if args.data_dir is not None else stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(directory, exist_ok = True)
+        results = []
+        print(f"{'duration (s)':>12} {'operation':<15} {'time (s)':>10} {'peak (MB)':>10}" + (f" {'time ratio':>10} {'peak ratio':>10}" if baseline else ""))
+        for duration in args.sizes:
+            paths = recording(directory, duration, args.channels, args.fs, args.seed)
+            for op in args.ops:
+                elapsed, peak = measure(BENCHMARKS[op], paths, args.repeat)
+                row = {'duration': duration, 'op': op, 'time': elapsed, 'peak': peak}
+                results.append(row)
+                line = f"{duration:>12g} {op:<15} {elapsed:>10.4f} {peak/1e6:>10.1f}"
+                if (duration, op) in baseline:
+                    previous = baseline[(duration, op)]
+                    line += f" {elapsed/previous['time']:>10.2f} {peak/max(previous['peak'], 1):>10.2f}"
+                print(line, flush = True)
+
+    if args.output is not None:
+        environment = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                       'import_numpy': numpy_time, 'import_spikertools': import_time, 'channels': args.channels, 'fs': args.fs, 'seed': args.seed, 'repeat': args.repeat}
+        with open(args.output, 'w') as output_file:
+            json.dump({'environment': environment, 'results': results}, output_file, indent = 1)
+
+if __name__ == '__main__':
+    main()
@@ -13,29 +13,735 @@ Imports for needed libraries
 """
 
 import numpy as np
-from scipy import signal  
 import math
-from scipy.io import wavfile
-import matplotlib.pyplot as plt
+import numbers
+import operator
+import os
+import importlib
 from datetime import datetime
+from fractions import Fraction
+from functools import lru_cache, wraps
+import concurrent.futures
+import glob
+import json
 import random
+import threading
+import time
+import traceback
+import tracemalloc
+import inspect
+import wave
+
+#scipy.signal, scipy.io.wavfile and matplotlib.pyplot take most of the time of importing this module, and batch workers never plot,
+#so they are imported on first use: each name below is a placeholder that imports its module and replaces itself with it
+#in the module namespace the first time one of its attributes is accessed
+class _LazyModule:
+    def __init__(self, name, alias):
+        self._name = name #module to import
+        self._alias = alias #module-level name the placeholder is bound to
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+signal = _LazyModule('scipy.signal', 'signal')
+wavfile = _LazyModule('scipy.io.wavfile', 'wavfile')
+plt = _LazyModule('matplotlib.pyplot', 'plt')
+ndimage = _LazyModule('scipy.ndimage', 'ndimage')
+fft = _LazyModule('scipy.fft', 'fft')
+
+"""Filter Design"""
+
+#maximum number of filter designs kept by design_filter before the least recently used one is evicted
+FILTER_CACHE_SIZE = 128
+
+@lru_cache(maxsize = FILTER_CACHE_SIZE)
+def _design_sos(cutoff, ftype, fs, filter_order):
+    if (ftype == 'hp'): #highpass filter
+        sos = signal.butter(filter_order, cutoff, 'highpass', fs=fs, output='sos')
+    elif (ftype == 'lp'): #lowpass filter
+        sos = signal.butter(filter_order, cutoff, 'lowpass', fs=fs, output='sos')
+    elif (ftype == 'n'): #notch filter
+        Q = (math.sqrt((cutoff+1)*(cutoff-1)))/2
+        b_notch, a_notch = signal.iirnotch(cutoff, Q, fs)
+        sos = signal.tf2sos(b_notch, a_notch)
+    elif (ftype == 'bp'): #bandpass filter
+        sos = signal.butter(filter_order, cutoff, 'bandpass', fs=fs, output='sos')
+    elif (ftype == 'br'): #band reject filter
+        sos = signal.butter(filter_order, cutoff, 'bandstop', fs=fs, output='sos')
+    else:
+        raise Exception("Incorrect filter type specified!")
+    return sos
+
+def design_filter(cutoff, ftype, fs, filter_order = 2):
+    '''
+    Design the filter used by Channel.filt as second-order sections.
+    Designs are memoized on (cutoff, ftype, fs, filter_order), so repeated filtering of many channels
+    or files with the same settings designs each filter only once (see FILTER_CACHE_SIZE).
+
+    Keyword Arguments:
+    cutoff -- cutoff frequency (int or float), or low and high cutoff frequencies for 'bp' and 'br' (list, tuple or array)
+    ftype -- 'hp', 'lp', 'n', 'bp' or 'br' (string)
+    fs -- sampling frequency of the data to filter (float)
+    filter_order -- filter order (int)
+
+    Return:
+    array of second-order sections, shape (n_sections, 6)
+    '''
+    if (ftype == 'bp' or ftype == 'br'):
+        assert (np.size(cutoff) == 2), "Must specify 2-element list"
+        #any 2-element array-like is accepted; a tuple of floats is the cache key
+        cutoff = tuple(float(frequency) for frequency in np.ravel(cutoff))
+    else:
+        assert (isinstance(cutoff, float) or isinstance(cutoff,int)), "Must specify integer or float."
+        cutoff = float(cutoff)
+    #the cached design is shared, so each caller gets its own small copy
+    return _design_sos(cutoff, ftype, float(fs), int(filter_order)).copy()
+
+design_filter.cache_info = _design_sos.cache_info
+design_filter.cache_clear = _design_sos.cache_clear
+
+"""Chunked Filtering"""
+
+#number of padding samples used by signal.sosfiltfilt for the second-order sections sos
+def _sos_padlen(sos):
+    ntaps = 2*len(sos) + 1
+    ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3*ntaps
+
+#zero-phase filtering equivalent to signal.sosfiltfilt(sos, x, axis=-1), computed chunk_size samples at a time
+#x may be a single channel or a (channels x samples) array; all channels are filtered together along the last axis
+#filter state is carried between chunks, and the odd-extension padding used by sosfiltfilt is applied at both ends
+#the forward pass is written to out (any writable array, e.g. an np.memmap), then overwritten in place by the backward pass
+#the filter always runs in float64; dtype is only the dtype of out when out is created here
+def _sosfiltfilt_chunked(sos, x, chunk_size, out = None, dtype = np.float64):
+    n = x.shape[-1]
+    padlen = _sos_padlen(sos)
+    if (n <= padlen):
+        raise Exception(f"Data must be longer than {padlen} samples to be filtered.")
+    if (chunk_size < 1):
+        raise Exception("chunk_size must be a positive number of samples.")
+    #IIR filters with low cutoffs are unstable with float32 coefficients or state, so sos, the state and each chunk are float64
+    #and only the stored result is in the compute precision (see Channel.set_dtype); integer data is converted one chunk at a time
+    sos = np.asarray(sos, dtype = np.float64)
+    if out is None:
+        out = np.empty(x.shape, dtype = dtype)
+    #initial conditions have shape (n_sections, channels..., 2) and are scaled by the first sample of each channel
+    zi = signal.sosfilt_zi(sos).reshape((len(sos),) + (1,)*(x.ndim - 1) + (2,))
+    #padding is computed before the forward pass so that out may be the same array as x
+    left_ext = 2*np.asarray(x[..., :1], dtype = np.float64) - np.asarray(x[..., padlen:0:-1], dtype = np.float64)
+    right_ext = 2*np.asarray(x[..., -1:], dtype = np.float64) - np.asarray(x[..., -2:-padlen-2:-1], dtype = np.float64)
+
+    #forward pass
+    _, state = signal.sosfilt(sos, left_ext, zi = zi*left_ext[..., :1])
+    for start in range(0, n, chunk_size):
+        block, state = signal.sosfilt(sos, np.asarray(x[..., start:start + chunk_size], dtype = np.float64), zi = state)
+        out[..., start:start + chunk_size] = block
+    right_out, state = signal.sosfilt(sos, right_ext, zi = state)
+
+    #backward pass, from the end of the data to the start
+    _, state = signal.sosfilt(sos, right_out[..., ::-1], zi = zi*right_out[..., -1:])
+    for stop in range(n, 0, -chunk_size):
+        start = max(stop - chunk_size, 0)
+        block, state = signal.sosfilt(sos, np.asarray(out[..., start:stop][..., ::-1], dtype = np.float64), zi = state)
+        out[..., start:stop] = block[..., ::-1]
+    return out
+
+#zero-phase filtering of x along its last axis, computed in float64 and returned (or written to out) in dtype
+#float64 results without chunk_size come from one signal.sosfiltfilt call; other results are filtered in float64 chunks
+#(default 2**16 samples), so a float32 result is never built from a full-size float64 copy of the data
+def _sosfiltfilt(sos, x, dtype, chunk_size = None, out = None):
+    if (chunk_size is None) and (np.dtype(dtype) == np.float64):
+        filtered = signal.sosfiltfilt(sos, np.asarray(x, dtype = np.float64), axis = -1)
+        if out is None:
+            return filtered
+        out[...] = filtered
+        return out
+    return _sosfiltfilt_chunked(sos, x, chunk_size if chunk_size is not None else 2**16, out, dtype)
+
+#standard deviation along the last axis (keepdims), accumulated in float64 chunk_size samples at a time,
+#so that float32 or integer data is not converted to a full-size float64 temporary as np.std(x, dtype=np.float64) does
+def _chunked_std(x, chunk_size = 2**16):
+    n = x.shape[-1]
+    mean = np.mean(x, axis=-1, keepdims=True, dtype=np.float64)
+    sum_squares = 0
+    for start in range(0, n, chunk_size):
+        deviation = x[..., start:start + chunk_size] - mean
+        sum_squares = sum_squares + np.sum(deviation*deviation, axis=-1, keepdims=True)
+    return np.sqrt(sum_squares/n)
+
+"""Resampling"""
+
+@lru_cache(maxsize = FILTER_CACHE_SIZE)
+def _design_resampler(up, down):
+    max_rate = max(up, down)
+    half_len = 10*max_rate
+    return signal.firwin(2*half_len + 1, 1/max_rate, window = ('kaiser', 5.0))
+
+def design_resampler(up, down):
+    '''
+    Design the anti-aliasing FIR filter for resampling by the ratio up/down with a polyphase filter.
+    The filter is the Kaiser-windowed sinc that signal.resample_poly designs by default, with its cutoff at the lower
+    of the input and output Nyquist frequencies. Designs are cached per ratio, like design_filter.
+
+    Keyword Arguments:
+    up -- upsampling factor (int)
+    down -- downsampling factor (int)
+
+    Return:
+    array of FIR filter taps
+    '''
+    return _design_resampler(int(up), int(down)).copy()
+
+design_resampler.cache_info = _design_resampler.cache_info
+design_resampler.cache_clear = _design_resampler.cache_clear
+
+def resample_ratio(fs_in, fs_out, max_denominator = 1000):
+    '''
+    Returns the smallest integers (up, down) with fs_out/fs_in = up/down, e.g. (100, 441) for 44100 Hz to 10000 Hz.
+    Ratios that are not exactly rational with a denominator of at most max_denominator are approximated;
+    the sampling rate after resampling is then fs_in*up/down.
+    '''
+    if (fs_in <= 0) or (fs_out <= 0):
+        raise Exception("Sampling rates must be positive.")
+    ratio = (Fraction(fs_out)/Fraction(fs_in)).limit_denominator(max_denominator)
+    if (ratio == 0):
+        raise Exception(f"Cannot resample from {fs_in} Hz to {fs_out} Hz with a denominator of at most {max_denominator}.")
+    return ratio.numerator, ratio.denominator
+
+#polyphase resampling of x by up/down along the last axis in the given dtype, equivalent to signal.resample_poly
+#with the cached filter of design_resampler; if chunk_size is set, x is read chunk_size samples at a time (see _resample_chunked)
+def _resample(x, up, down, dtype, chunk_size = None, out = None):
+    taps = _design_resampler(up, down).astype(dtype)
+    if chunk_size is not None:
+        return _resample_chunked(x, up, down, taps, chunk_size, out)
+    resampled = signal.resample_poly(np.asarray(x, dtype = dtype), up, down, axis = -1, window = taps)
+    if out is None:
+        return resampled
+    out[...] = resampled
+    return out
+
+#signal.resample_poly(x, up, down, axis=-1, window=taps) computed about chunk_size input samples at a time
+#output chunks start at multiples of up, i.e. at whole input samples, and each is computed from its input samples plus
+#a margin of whole multiples of down on both sides that covers the filter, so every output sample sees the same inputs
+#(and the same zero padding at the ends of the data) as in one call over the whole array
+def _resample_chunked(x, up, down, taps, chunk_size, out = None):
+    n = x.shape[-1]
+    nout = -(-n*up//down)
+    if out is None:
+        out = np.empty(x.shape[:-1] + (nout,), dtype = taps.dtype)
+    margin = down*(-(-((len(taps) - 1)//2//up + 2)//down))
+    step = up*max(chunk_size//down, 1)
+    for first_out in range(0, nout, step):
+        last_out = min(first_out + step, nout)
+        start = first_out*down//up
+        first = max(start - margin, 0)
+        last = min(-(-last_out*down//up) + margin, n)
+        block = signal.resample_poly(np.asarray(x[..., first:last], dtype = taps.dtype), up, down, axis = -1, window = taps)
+        offset = (start - first)*up//down
+        out[..., first_out:last_out] = block[..., offset:offset + last_out - first_out]
+    return out
+
+"""Filter Pipeline"""
+
+class FilterPipeline:
+    def __init__(self, owner, channel_index = None):
+        self._owner = owner #Channel or Session that the stages are applied to
+        self._channel_index = channel_index #for a Session, the channel to filter (None filters all channels)
+        self._stages = [] #(cutoff, ftype, filter_order) in the order they were added
+
+    def get_stages(self):
+        '''
+        Returns the list of (cutoff, ftype, filter_order) stages collected so far.
+        '''
+        return self._stages
+
+    def filt(self, cutoff, ftype, filter_order = 2):
+        '''
+        Add a filter stage to the pipeline. Nothing is computed until apply is called.
+
+        Keyword Arguments:
+        cutoff -- cutoff frequency (int or float), or a 2-element list for 'bp' and 'br'
+        ftype -- 'hp', 'lp', 'n', 'bp' or 'br' (string)
+        filter_order -- filter order (int)
+
+        Return:
+        the pipeline, so stages can be chained
+        '''
+        self._stages.append((cutoff, ftype, filter_order))
+        return self
+
+    def apply(self, chunk_size = None, out = None):
+        '''
+        Cascade all stages into one set of second-order sections and filter the data in a single
+        zero-phase forward/backward pass, instead of one pass per stage.
+        The result matches running filt for each stage in turn, apart from edge effects at the start and end of the data.
+
+        Keyword Arguments:
+        chunk_size -- if set, filters chunk_size samples at a time to bound memory use (int)
+        out -- if set, the result is written to this array, e.g. a disk-backed np.memmap, shaped like the filtered data (array)
+
+        Return:
+        the Channel or Session the pipeline was created from
+        '''
+        if (len(self._stages) == 0):
+            return self._owner
+        if self._channel_index is None:
+            self._owner._filt_stages(self._stages, chunk_size = chunk_size, out = out)
+        else:
+            self._owner._filt_stages(self._stages, channel_index = self._channel_index, chunk_size = chunk_size, out = out)
+        self._stages = []
+        return self._owner
+
+"""Time Axis"""
+
+#time vector of a channel, computed on demand from sample indices and the sampling frequency
+#indexing and slicing behave like the equivalent np.arange(nsamples)/fs array, but only the requested values are created
+#arithmetic, comparisons, numpy functions and ndarray methods (max, mean, ...) work on the materialized array
+class TimeAxis(np.lib.mixins.NDArrayOperatorsMixin):
+    def __init__(self, nsamples, fs, first_sample = 0):
+        self._nsamples = nsamples #number of samples in the channel
+        self._fs = fs #sampling frequency of the channel
+        self._first_sample = first_sample #index of the first sample, for channels that do not start at time 0
+
+    def __len__(self):
+        return self._nsamples
+
+    @property
+    def shape(self):
+        return (self._nsamples,)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self._nsamples
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._nsamples)
+            return (self._first_sample + np.arange(start, stop, step))/self._fs
+        if (np.ndim(index) == 0):
+            sample = operator.index(index)
+            if (sample < -self._nsamples) or (sample >= self._nsamples):
+                raise IndexError(f"index {index} is out of bounds for time axis with {self._nsamples} samples")
+            return (self._first_sample + sample % self._nsamples)/self._fs
+        samples = np.arange(self._nsamples)[index] if (np.asarray(index).dtype == bool) else np.asarray(index)
+        if np.any(samples < -self._nsamples) or np.any(samples >= self._nsamples):
+            raise IndexError(f"index out of bounds for time axis with {self._nsamples} samples")
+        return (self._first_sample + samples % self._nsamples)/self._fs
+
+    def __array__(self, dtype = None, copy = None):
+        if copy is False:
+            raise ValueError("A TimeAxis is computed on demand, so it cannot be converted to an array without a copy.")
+        return self[:] if dtype is None else self[:].astype(dtype, copy = False)
+
+    #ufuncs (and the operators of NDArrayOperatorsMixin) are applied to the materialized times
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, TimeAxis) else x for x in inputs)
+        if any(isinstance(x, TimeAxis) for x in kwargs.get('out', ())):
+            raise TypeError("A TimeAxis is read-only and cannot be used as out.")
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    #other ndarray attributes and methods (max, mean, tolist, ...) are those of the materialized times
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self[:], name)
+
+    def __repr__(self):
+        return f"TimeAxis(nsamples={self._nsamples}, fs={self._fs}, first_sample={self._first_sample})"
+
+"""Overview Pyramid"""
+
+#level of the finest bins of an OverviewPyramid (2**6 = 64 samples per bin)
+PYRAMID_BASE_LEVEL = 6
+
+#min/max summary of a channel at successive powers of two: level k holds the minimum and maximum of every 2**k samples
+#any interval can be drawn from the coarsest level that still has at least one bin per pixel, without reading the samples
+class OverviewPyramid:
+    def __init__(self, mins, maxs, nsamples, base_level = PYRAMID_BASE_LEVEL):
+        self._mins = mins #bin minima per level, from base_level upwards
+        self._maxs = maxs #bin maxima per level, from base_level upwards
+        self._nsamples = nsamples #number of samples summarized
+        self._base_level = base_level #level of the finest bins, 2**base_level samples per bin
+
+    def get_nsamples(self):
+        return self._nsamples
+    def get_levels(self):
+        '''
+        Returns the list of levels in the pyramid; level k has bins of 2**k samples.
+        '''
+        return list(range(self._base_level, self._base_level + len(self._mins)))
+    def get_level(self, level):
+        '''
+        Returns the bin minima and maxima (arrays) of a level of the pyramid.
+        '''
+        return self._mins[level - self._base_level], self._maxs[level - self._base_level]
+
+    def envelope(self, first, last, npixels):
+        '''
+        Reduce samples first:last to a min/max envelope of about npixels bins, read from the pyramid.
+
+        Keyword Arguments:
+        first -- first sample of the interval (int)
+        last -- end sample of the interval, exclusive (int)
+        npixels -- number of bins to reduce the interval to (int)
+
+        Return:
+        (bin centers in samples, bin minima, bin maxima), or None if the interval is too short for the finest level
+        '''
+        samples_per_pixel = (last - first)/npixels
+        if (samples_per_pixel < 2**self._base_level):
+            return None
+        level = min(int(math.log2(samples_per_pixel)), self._base_level + len(self._mins) - 1)
+        mins, maxs = self.get_level(level)
+        first_bin = first >> level
+        last_bin = min(-(-last >> level), len(mins))
+        mins = mins[first_bin:last_bin]
+        maxs = maxs[first_bin:last_bin]
+        group = max(len(mins)//npixels, 1)
+        group_starts = np.arange(0, len(mins), group)
+        centers = (first_bin + group_starts + np.minimum(group, len(mins) - group_starts)/2)*2**level
+        return np.minimum(centers, self._nsamples), np.minimum.reduceat(mins, group_starts), np.maximum.reduceat(maxs, group_starts)
+
+    def save(self, path, signature):
+        '''
+        Save the pyramid to an .npz file together with a signature of the data it summarizes (see load_pyramid).
+        '''
+        levels = {f"mins_{i}": mins for i, mins in enumerate(self._mins)}
+        levels.update({f"maxs_{i}": maxs for i, maxs in enumerate(self._maxs)})
+        np.savez(path, signature=np.asarray(signature, dtype=np.float64), nsamples=self._nsamples, base_level=self._base_level, **levels)
+
+#builds the OverviewPyramid of data in one streaming pass, reading chunk_size samples at a time
+#only the finest level is computed from the samples; every coarser level is reduced from the level below it
+def build_pyramid(data, base_level = PYRAMID_BASE_LEVEL, chunk_size = 2**20):
+    nsamples = len(data)
+    bin_size = 2**base_level
+    chunk_size = max(chunk_size//bin_size, 1)*bin_size
+    mins, maxs = [], []
+    for start in range(0, nsamples, chunk_size):
+        chunk = np.asarray(data[start:start + chunk_size])
+        bin_starts = np.arange(0, len(chunk), bin_size)
+        mins.append(np.minimum.reduceat(chunk, bin_starts))
+        maxs.append(np.maximum.reduceat(chunk, bin_starts))
+    mins = [np.concatenate(mins)] if (nsamples > 0) else [np.zeros(0, dtype=np.asarray(data).dtype)]
+    maxs = [np.concatenate(maxs)] if (nsamples > 0) else [np.zeros(0, dtype=np.asarray(data).dtype)]
+    while (len(mins[-1]) > 1):
+        pair_starts = np.arange(0, len(mins[-1]), 2)
+        mins.append(np.minimum.reduceat(mins[-1], pair_starts))
+        maxs.append(np.maximum.reduceat(maxs[-1], pair_starts))
+    return OverviewPyramid(mins, maxs, nsamples, base_level)
+
+#loads an OverviewPyramid saved with OverviewPyramid.save, or returns None if the file is missing or its signature differs
+def load_pyramid(path, signature):
+    try:
+        with np.load(path) as cached:
+            if not np.array_equal(cached["signature"], np.asarray(signature, dtype=np.float64)):
+                return None
+            nlevels = sum(1 for key in cached.files if key.startswith("mins_"))
+            mins = [cached[f"mins_{i}"] for i in range(nlevels)]
+            maxs = [cached[f"maxs_{i}"] for i in range(nlevels)]
+            return OverviewPyramid(mins, maxs, int(cached["nsamples"]), int(cached["base_level"]))
+    except (OSError, KeyError, ValueError):
+        return None
+
+"""Windowed Statistics"""
+
+#cumulative sums of the data and of its square, so that the mean, standard deviation and RMS of any interval take O(1)
+#the sums are taken in float64 over the data minus its overall mean, which keeps the variance of short intervals accurate
+#over hours of data; they are built chunk_size samples at a time and hold 16 bytes per sample
+class PrefixSums:
+    def __init__(self, data, chunk_size = 2**20):
+        nsamples = len(data)
+        self._offset = float(np.mean(data, dtype=np.float64)) if (nsamples > 0) else 0.0 #subtracted from the data before summing
+        self._sums = np.zeros(nsamples + 1) #self._sums[k] is the sum of the first k samples (minus the offset)
+        self._squares = np.zeros(nsamples + 1) #self._squares[k] is the sum of their squares
+        for start in range(0, nsamples, chunk_size):
+            centered = np.asarray(data[start:start + chunk_size], dtype=np.float64) - self._offset
+            stop = start + len(centered)
+            np.cumsum(centered, out=self._sums[start + 1:stop + 1])
+            self._sums[start + 1:stop + 1] += self._sums[start]
+            np.cumsum(centered*centered, out=self._squares[start + 1:stop + 1])
+            self._squares[start + 1:stop + 1] += self._squares[start]
+
+    def __len__(self):
+        return len(self._sums) - 1
+
+    def stats(self, first, last):
+        '''
+        Returns a dictionary with the 'mean', 'std' and 'rms' of the samples first (inclusive) to last (exclusive).
+        first and last may be arrays of sample indices, to get the statistics of many intervals at once.
+        '''
+        first = np.asarray(first)
+        last = np.asarray(last)
+        count = last - first
+        if np.any(count <= 0):
+            raise Exception("Intervals must contain at least one sample.")
+        mean = (self._sums[last] - self._sums[first])/count
+        variance = np.maximum((self._squares[last] - self._squares[first])/count - mean*mean, 0)
+        mean = mean + self._offset
+        return {'mean': mean, 'std': np.sqrt(variance), 'rms': np.sqrt(variance + mean*mean)}
+
+#minimum and maximum of each window data[start:start + window] for an array of window starts, with running min/max filters
+#evaluated over chunk_size samples at a time, so each sample is visited a constant number of times for any window length
+def _rolling_extremes(data, window, starts, chunk_size = 2**20):
+    mins = np.empty(len(starts))
+    maxs = np.empty(len(starts))
+    first = 0
+    while (first < len(starts)):
+        last = max(int(np.searchsorted(starts, starts[first] + chunk_size)), first + 1)
+        segment = np.asarray(data[starts[first]:starts[last - 1] + window])
+        offsets = starts[first:last] - starts[first]
+        #origin -(window//2) places each filter window at [i, i + window) instead of centering it on i
+        mins[first:last] = ndimage.minimum_filter1d(segment, window, origin = -(window//2))[offsets]
+        maxs[first:last] = ndimage.maximum_filter1d(segment, window, origin = -(window//2))[offsets]
+        first = last
+    return mins, maxs
+
+"""Instrumentation"""
+
+#Profiler collecting a record of every instrumented Channel/Session operation, None while profiling is disabled
+_profiler = None
+
+#records the time, bytes processed, peak allocation and parameters of the operations run while profiling is enabled
+#(see enable_profiling); operations that modify channel data are also added to the provenance log of each channel they modify
+class Profiler:
+    def __init__(self, memory = False):
+        self._memory = memory #if True, peak allocations are traced with tracemalloc
+        self._records = [] #one record per operation, in the order the operations started
+        self._child_times = [] #time spent in nested operations, one entry per operation currently running
+        self._started_tracing = False #whether tracemalloc was started by this Profiler
+        self._thread = threading.get_ident() #thread that enabled profiling; work done by Session worker threads counts towards the calling operation
+
+    def _run(self, name, func, args, kwargs, modifies):
+        if (threading.get_ident() != self._thread):
+            return func(*args, **kwargs)
+        owner = args[0]
+        record = {'operation': name, 'depth': len(self._child_times), 'params': self._params(func, args, kwargs),
+                  'start': datetime.now().isoformat(), 'time': None, 'self_time': None, 'bytes': _nbytes(owner), 'peak': None}
+        outermost = (record['depth'] == 0)
+        if self._memory and outermost:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        self._records.append(record)
+        self._child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            child_time = self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += elapsed
+            record['time'] = elapsed
+            record['self_time'] = elapsed - child_time
+            if self._memory and outermost:
+                record['peak'] = tracemalloc.get_traced_memory()[1] - baseline
+        record['bytes'] = max(record['bytes'], _nbytes(result if isinstance(owner, type) else owner))
+        #nested operations are part of the outermost one, which is the only one logged as provenance
+        if modifies and outermost:
+            entry = {'operation': name, 'params': record['params'], 'start': record['start'], 'time': record['time']}
+            channel_index = record['params'].get('channel_index')
+            if isinstance(owner, Channel):
+                channels = [owner]
+            elif isinstance(getattr(owner, '_channels', None), list):
+                channels = owner._channels if channel_index is None else [owner._channels[channel_index]]
+            else:
+                channels = []
+            for chan in channels:
+                chan._provenance.append(entry)
+        return result
+
+    #parameters of an operation by name, with arrays and objects replaced by short descriptions so that records can be saved as JSON
+    def _params(self, func, args, kwargs):
+        try:
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.items())[1:]
+        except TypeError:
+            arguments = list(enumerate(args[1:])) + list(kwargs.items())
+        return {str(key): _describe(value) for key, value in arguments}
+
+    def get_records(self):
+        '''
+        Returns the list of operation records, in the order the operations started.
+        Each record is a dictionary with the keys 'operation', 'depth' (0 for operations called directly, 1 and more for
+        operations called by another instrumented operation), 'params', 'start', 'time' and 'self_time' (seconds, self_time
+        excludes nested operations), 'bytes' (size of the channel data processed) and 'peak' (bytes, if memory is traced).
+        '''
+        return self._records
+
+    def summary(self):
+        '''
+        Returns a dictionary of operation name -> totals over all calls: 'calls', 'time', 'self_time', 'bytes' and 'peak' (the largest peak).
+        '''
+        totals = {}
+        for record in self._records:
+            total = totals.setdefault(record['operation'], {'calls': 0, 'time': 0.0, 'self_time': 0.0, 'bytes': 0, 'peak': None})
+            total['calls'] += 1
+            total['time'] += record['time']
+            total['self_time'] += record['self_time']
+            total['bytes'] += record['bytes']
+            if record['peak'] is not None:
+                total['peak'] = max(total['peak'] or 0, record['peak'])
+        return totals
+
+    def report(self, path = None):
+        '''
+        Returns a text table of the summary, sorted by self time.
+        If path is set, the records and the summary are also saved there as JSON.
+        '''
+        lines = [f"{'operation':<24} {'calls':>6} {'time (s)':>10} {'self (s)':>10} {'MB processed':>13} {'peak (MB)':>10}"]
+        for name, total in sorted(self.summary().items(), key = lambda item: -item[1]['self_time']):
+            peak = f"{total['peak']/1e6:>10.1f}" if total['peak'] is not None else f"{'-':>10}"
+            lines.append(f"{name:<24} {total['calls']:>6} {total['time']:>10.4f} {total['self_time']:>10.4f} {total['bytes']/1e6:>13.1f} {peak}")
+        if path is not None:
+            with open(path, 'w') as report_file:
+                json.dump({'summary': self.summary(), 'records': self._records}, report_file, indent = 1)
+        return "\n".join(lines)
+
+    def stop(self):
+        '''
+        Stops the tracemalloc tracing started by this Profiler.
+        '''
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return self
+
+def enable_profiling(memory = False):
+    '''
+    Start recording every Channel/Session operation (see Profiler). Profiling is disabled by default and then costs one check per call.
+
+    Keyword Arguments:
+    memory -- if True, the peak allocation of each operation is traced with tracemalloc, which slows numpy allocations down (Boolean)
+
+    Return:
+    the new Profiler
+
+    Example: profiler = enable_profiling(); Session1.pipeline().filt(300,'hp').apply(); print(profiler.report())
+    '''
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = Profiler(memory)
+    return _profiler
+
+def disable_profiling():
+    '''
+    Stop recording operations. Returns the Profiler with the records collected since enable_profiling, or None.
+    '''
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler.stop() if profiler is not None else None
+
+def get_profiler():
+    '''
+    Returns the active Profiler, or None if profiling is disabled.
+    '''
+    return _profiler
+
+#decorator for Channel/Session operations: runs the operation through the active Profiler, or calls it directly when profiling is disabled
+#operations that modify the channel data (modifies=True) are logged in the provenance of the channels they change
+def _instrumented(name, modifies = False):
+    def decorate(func):
+        @wraps(func)
+        def operation(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            return _profiler._run(name, func, args, kwargs, modifies)
+        return operation
+    return decorate
+
+#size in bytes of the channel data held by a Channel or Session
+def _nbytes(owner):
+    channels = getattr(owner, '_channels', None)
+    if not isinstance(channels, list):
+        channels = [owner]
+    return int(sum(getattr(chan.__dict__.get('_data'), 'nbytes', 0) for chan in channels if hasattr(chan, '__dict__')))
+
+#short JSON-compatible description of an operation parameter
+def _describe(value):
+    if isinstance(value, np.ndarray):
+        return f"array{value.shape} {value.dtype}"
+    if isinstance(value, (np.generic,)):
+        return value.item()
+    if isinstance(value, (bool, int, float, str, type(None))):
+        return value
+    if isinstance(value, (list, tuple)) and (len(value) <= 16):
+        return [_describe(item) for item in value]
+    if isinstance(value, np.dtype) or (isinstance(value, type) and issubclass(value, np.generic)):
+        return np.dtype(value).name
+    return type(value).__name__
+
+"""Spike Detection"""
+
+#refractory period of a threshold-crossing detector: keeps the crossings at least refractory_samples after the previous kept one
+#last_kept is the sample index of the last spike kept before these crossings (carried across chunks and blocks)
+#a crossing that far from the previous crossing is always kept, so only the crossings closer than that are checked one by one
+#returns the kept crossings and the new last_kept
+def _refractory_filter(crossings, refractory_samples, last_kept):
+    keep = np.diff(crossings, prepend = last_kept) >= refractory_samples
+    for i in np.flatnonzero(~keep):
+        if (i > 0) and keep[i - 1]:
+            last_kept = crossings[i - 1]
+        keep[i] = (crossings[i] - last_kept >= refractory_samples)
+    kept = crossings[keep]
+    return kept, (kept[-1] if (len(kept) > 0) else last_kept)
 
 """Channel Class """
 
 class Channel:
-    def __init__(self, data = None, fs= None, filterfreqs= None, label= None, color= None):
+    def __init__(self, data = None, fs= None, filterfreqs= None, label= None, color= None, dtype= None):
+        self._dtype = np.dtype(dtype if dtype is not None else np.float64) #precision of filtering, decimation, normalization and epoching, float64 or float32
         self._data = data if data is not None else [] #data extracted from WAV file, default is empty list
         self._fs = fs if fs is not None else 0 #sampling frequency extracted from WAV file, default is 10,000 Hz
         self._filterfreqs = filterfreqs if filterfreqs is not None else [0,10000] # bandpass filter cutoff frequencies, set by user, default is 0 to 10000 Hz
         self._label = label if label is not None else "channel" #channel string label set by user, default is channel 
         self._color = color if color is not None else 'k' #set by user
-        self._t = np.arange(0, (len(self._data)/self._fs), (1/self._fs)) #time vector, elaborated from sample rate and duration of data
+        self._t = TimeAxis(len(self._data), self._fs) #time vector, elaborated from sample rate and duration of data when it is indexed
+        self._pyramid = None #min/max overview pyramid of the data, built on first use (see get_pyramid)
+        self._prefix_sums = None #cumulative sums of the data for interval statistics, built on first use (see get_prefix_sums)
+        self._source = None #(WAV path, channel index) while the data is unmodified WAV data, set by Session
+        self._provenance = [] #operations that modified the data while profiling was enabled, in order (see enable_profiling)
 
         print("Channel created.")
 
     #getter functions for channel attributes
     def get_data(self):
         return self._data
+    #returns the OverviewPyramid of the channel data, building it in one pass over the data on first use
+    #while the data is unmodified WAV data, the pyramid is cached on disk next to the WAV file and reused by later Sessions
+    @_instrumented('Channel.get_pyramid')
+    def get_pyramid(self):
+        if self._pyramid is None:
+            cache_path, signature = self._pyramid_cache()
+            if cache_path is not None:
+                self._pyramid = load_pyramid(cache_path, signature)
+            if self._pyramid is None:
+                self._pyramid = build_pyramid(self._data)
+                if cache_path is not None:
+                    try:
+                        self._pyramid.save(cache_path, signature)
+                    except OSError:
+                        pass #the pyramid is still used from memory if the WAV directory is not writable
+        return self._pyramid
+    #returns the PrefixSums of the channel data, built in one pass over the data on first use and kept until the data changes
+    def get_prefix_sums(self):
+        if self._prefix_sums is None:
+            self._prefix_sums = PrefixSums(self._data)
+        return self._prefix_sums
     def get_fs(self):
         return self._fs
     def get_time(self):
@@ -46,13 +752,19 @@ class Channel:
         return self._label
     def get_color(self):
         return self._color 
+    def get_provenance(self):
+        return self._provenance
+    def get_dtype(self):
+        return self._dtype
     #setter functions for channel attributes
     def set_data(self, data_in):
         self._data = data_in
+        self._invalidate()
+        self._t = TimeAxis(len(self._data), self._fs)
         return self._data
     def set_fs(self, fs_in):
         self._fs = fs_in 
-        self._t = np.arange(0, (len(self._data)/self._fs), (1/self._fs))
+        self._t = TimeAxis(len(self._data), self._fs)
         return self._fs 
     def set_filterfreqs(self, filterfreqs_in):
         self._filterfreqs = filterfreqs_in
@@ -63,6 +775,29 @@ class Channel:
     def set_color (self, color_in):
         self._color = color_in
         return self._color 
+    #sets the compute precision; data already processed keeps its dtype until the next operation
+    def set_dtype (self, dtype_in):
+        dtype_in = np.dtype(dtype_in)
+        if dtype_in not in (np.float32, np.float64):
+            raise Exception("Compute precision must be float32 or float64")
+        self._dtype = dtype_in
+        return self._dtype
+    #path and signature of the on-disk pyramid cache, or (None, None) if the data no longer matches the WAV file
+    def _pyramid_cache(self):
+        if self._source is None:
+            return None, None
+        datapath, channel_index = self._source
+        try:
+            stat = os.stat(datapath)
+        except OSError:
+            return None, None
+        signature = [stat.st_size, stat.st_mtime_ns, channel_index, len(self._data), self._fs]
+        return f"{os.path.splitext(datapath)[0]}-ch{channel_index}.pyramid.npz", signature
+    #called whenever self._data is modified: drops the pyramid and detaches the channel from its on-disk cache
+    def _invalidate(self):
+        self._pyramid = None
+        self._prefix_sums = None
+        self._source = None
     #delete functions for channel attributes
     def del_data(self):
         del self._data
@@ -79,100 +814,415 @@ class Channel:
     
     #tool functions for channel objects
 
-    #filtering function (lowpass, highpass, notch, bandpass, band reject)
+    #zero-phase filtering of self._data with second-order sections sos
+    #if chunk_size is set, the data is filtered chunk_size samples at a time with bounded memory (see _sosfiltfilt_chunked)
+    #if out is set, the result is written to out (e.g. a disk-backed np.memmap) and out is returned
+    def _sosfiltfilt(self, sos, chunk_size = None, out = None):
+        return _sosfiltfilt(sos, self._data, self._dtype, chunk_size, out)
+
+    #zero-phase filtering with a cascade of filter stages, given as a list of (cutoff, ftype, filter_order)
+    #the stages are designed (see design_filter), stacked into one set of second-order sections
+    #and applied in a single forward/backward pass over the data
     #modifies self._data and self._filterfreqs
-    def filt(self, cutoff, ftype, filter_order = 2):
-        if (cutoff > ((self._fs)/2)):
-            raise Exception(f"Filter frequency should not exceed Nyquist: {(self._fs)/2} ")
-        if (ftype == 'hp'): #highpass filter
-            assert (isinstance(cutoff, float) or isinstance(cutoff,int)), "Must specify integer or float."
-            b_hpf, a_hpf = signal.butter(filter_order, cutoff, 'highpass', fs=self._fs)
-            out = signal.filtfilt(b_hpf, a_hpf, self._data)
-            self._filterfreqs[0] = cutoff
-            self._data = out
-        elif (ftype == 'lp'):#lowpass fitler
-            assert (isinstance(cutoff, float) or isinstance(cutoff,int)), "Must specify integer or float."
-            b_lpf, a_lpf = signal.butter(filter_order, cutoff, 'lowpass', fs=self._fs)
-            out = signal.filtfilt(b_lpf, a_lpf, self._data)
-            self._filterfreqs[1]= cutoff
-            self._data = out
-        elif (ftype == 'n'): #notch filter
-            assert (isinstance(cutoff, float) or isinstance(cutoff,int)), "Must specify integer or float."
-            Q = (math.sqrt((cutoff+1)*(cutoff-1)))/2
-            b_notch, a_notch = signal.iirnotch(cutoff, Q ,self._fs)
-            out = signal.filtfilt(b_notch, a_notch, self._data)
-            self._data = out
-        elif (ftype == 'bp'): #bandpass filter
-            assert (isinstance(cutoff, list), "Must specify 2-element list") 
-            b_bpf, a_bpf = signal.butter(filter_order, cutoff, 'bandpass', fs=self._fs)
-            out = signal.filtfilt(b_bpf, a_bpf, self._data)
-            self._filterfreqs = cutoff
-            self._data = out
-        elif (ftype == 'br'): #band reject filter
-            assert (isinstance(cutoff, list), "Must specify 2-element list")
-            b_brf, a_brf = signal.butter(filter_order, cutoff, 'bandstop', fs = self._fs)
-            out = signal.filtfilt(b_brf, a_brf, self._data)
-            self._data = out
-        else: 
-            raise Exception("Incorrect filter type specified!")
+    @_instrumented('Channel.filt', modifies = True)
+    def _filt_stages(self, stages, chunk_size = None, out = None):
+        sos = self._design_stages(stages)
+        self._data = self._sosfiltfilt(sos, chunk_size, out)
+        self._invalidate()
+        self._record_stages(stages)
         return self
 
+    #checks the filter stages against the Nyquist frequency and returns their cascaded second-order sections
+    #the sections stay in float64 whatever the compute precision, since rounding them to float32 breaks low-cutoff filters
+    def _design_stages(self, stages):
+        for cutoff, ftype, filter_order in stages:
+            if (np.max(cutoff) > ((self._fs)/2)):
+                raise Exception(f"Filter frequency should not exceed Nyquist: {(self._fs)/2} ")
+        return np.vstack([design_filter(cutoff, ftype, self._fs, filter_order) for cutoff, ftype, filter_order in stages])
+
+    #updates self._filterfreqs after the filter stages have been applied
+    def _record_stages(self, stages):
+        for cutoff, ftype, filter_order in stages:
+            if (ftype == 'hp'):
+                self._filterfreqs[0] = cutoff
+            elif (ftype == 'lp'):
+                self._filterfreqs[1] = cutoff
+            elif (ftype == 'bp'):
+                self._filterfreqs = cutoff
+
+    #filtering function (lowpass, highpass, notch, bandpass, band reject)
+    #modifies self._data and self._filterfreqs
+    #the filter is designed once per setting and cached (see design_filter)
+    #chunk_size and out select the streaming mode for recordings larger than memory (see _sosfiltfilt)
+    def filt(self, cutoff, ftype, filter_order = 2, chunk_size = None, out = None):
+        return self._filt_stages([(cutoff, ftype, filter_order)], chunk_size, out)
+
+    #returns a FilterPipeline that collects filt() stages and applies them to this channel in one pass
+    #e.g. chan.pipeline().filt(300,'hp').filt(60,'n').filt(3000,'lp').apply()
+    def pipeline(self):
+        return FilterPipeline(self)
+
+    #standard deviation of the data, or of the data between interval[0] and interval[1] seconds
+    #an interval is computed from its own samples, or from the prefix sums if get_interval_stats has already built them,
+    #so that one query does not build prefix sums for the whole channel
     def get_std(self, interval=[0,0]):
-        if (interval == [0,0]):
+        if (list(interval) == [0,0]):
             return np.std(self._data)
-        else: 
-            spec_interval = self._data[(interval[0]*self._fs), (interval[1]*self._fs)]
-            return np.std(spec_interval)
-    
+        elif self._prefix_sums is not None:
+            return self.get_interval_stats(interval[0], interval[1])['std']
+        else:
+            first, last = self._interval_samples(interval[0], interval[1])
+            if (last <= first):
+                raise Exception("Intervals must contain at least one sample.")
+            return _chunked_std(self._data[first:last])[0]
+
+    #sample indices of the first (inclusive) and last (exclusive) samples between lbound and rbound seconds, clipped to the data
+    def _interval_samples(self, lbound, rbound):
+        first = np.clip(np.round(np.asarray(lbound)*self._fs).astype(np.int64), 0, len(self._data))
+        last = np.clip(np.round(np.asarray(rbound)*self._fs).astype(np.int64), 0, len(self._data))
+        return first, last
+
+    #mean, standard deviation and RMS of the data between lbound and rbound seconds, in O(1) from the cached prefix sums
+    #lbound and rbound may be arrays, to get the statistics of many intervals in one call
+    #returns a dictionary of 'mean', 'std' and 'rms'
+    def get_interval_stats(self, lbound, rbound):
+        first, last = self._interval_samples(lbound, rbound)
+        return self.get_prefix_sums().stats(first, last)
+
+    #statistics of the data in windows of window seconds, one window every step seconds (default: step = window, no overlap)
+    #stats is a list of 'mean', 'std', 'rms' (from the cached prefix sums), 'min', 'max' and 'peak' (max |x|, the peak envelope),
+    #all computed for every window at once; windows that would run past the end of the data are left out
+    #returns the time of the center of each window in seconds, and a dictionary of stat -> array with one value per window
+    @_instrumented('Channel.rolling_stats')
+    def rolling_stats(self, window, step = None, stats = ('mean', 'std', 'rms', 'peak')):
+        window_samples = int(round(window*self._fs))
+        step_samples = window_samples if step is None else int(round(step*self._fs))
+        if (window_samples < 1) or (step_samples < 1) or (window_samples > len(self._data)):
+            raise Exception(f"Window and step must be at least one sample, and the window at most {len(self._data)/self._fs} s long.")
+        starts = np.arange(0, len(self._data) - window_samples + 1, step_samples)
+        result = {}
+        if any(stat in ('mean', 'std', 'rms') for stat in stats):
+            result.update(self.get_prefix_sums().stats(starts, starts + window_samples))
+        if any(stat in ('min', 'max', 'peak') for stat in stats):
+            result['min'], result['max'] = _rolling_extremes(self._data, window_samples, starts)
+            result['peak'] = np.maximum(-result['min'], result['max'])
+        unknown = [stat for stat in stats if stat not in result]
+        if unknown:
+            raise Exception(f"Unknown statistics {unknown}, use 'mean', 'std', 'rms', 'min', 'max' or 'peak'")
+        return (starts + window_samples/2)/self._fs, {stat: result[stat] for stat in stats}
     
-    #downsampling function, applies an anti-aliasing filter first, then downsamples
+    #threshold-crossing spike detector, streamed over the data chunk_size samples at a time (default 10 seconds)
+    #the noise level is estimated per chunk, either robustly as median(|x|)/0.6745 ('mad') or as the standard deviation ('std'),
+    #and a spike is the first sample that crosses threshold*noise in the given direction ('neg', 'pos' or 'both')
+    #a crossing within refractory seconds of the previous detected spike is discarded
+    #returns spike times in seconds and an array of waveform snippets (spikes x samples) from snippet[0] seconds before
+    #to snippet[1] seconds after each crossing; spikes whose snippet would run past the start or end of the data are left out
+    @_instrumented('Channel.detect_spikes')
+    def detect_spikes(self, threshold = 5, noise = 'mad', direction = 'neg', refractory = 0.001, snippet = (0.0005, 0.001), chunk_size = None):
+        if chunk_size is None:
+            chunk_size = int(10*self._fs)
+        nsamples = len(self._data)
+        refractory_samples = int(round(refractory*self._fs))
+        last_spike = -refractory_samples - 1
+        spikes = []
+        for start in range(0, nsamples, chunk_size):
+            #one sample of lead-in from the previous chunk catches crossings on the chunk boundary
+            lead = 1 if (start > 0) else 0
+            block = np.asarray(self._data[start - lead:start + chunk_size], dtype=np.float64)
+            if (noise == 'mad'):
+                level = threshold*np.median(np.abs(block[lead:]))/0.6745
+            elif (noise == 'std'):
+                level = threshold*np.std(block[lead:])
+            else:
+                raise Exception("Incorrect noise estimate specified, use 'mad' or 'std'")
+            if (direction == 'neg'):
+                above = block < -level
+            elif (direction == 'pos'):
+                above = block > level
+            elif (direction == 'both'):
+                above = np.abs(block) > level
+            else:
+                raise Exception("Incorrect spike direction specified, use 'neg', 'pos' or 'both'")
+            if lead:
+                crossings = np.flatnonzero(above[1:] & ~above[:-1]) + start
+            else:
+                crossings = np.flatnonzero(above & ~np.concatenate(([False], above[:-1])))
+            if (len(crossings) == 0):
+                continue
+            crossings, last_spike = _refractory_filter(crossings, refractory_samples, last_spike)
+            spikes.append(crossings)
+        spikes = np.concatenate(spikes) if spikes else np.zeros(0, dtype=np.int64)
+
+        before = int(round(snippet[0]*self._fs))
+        after = int(round(snippet[1]*self._fs))
+        spikes = spikes[(spikes - before >= 0) & (spikes + after <= nsamples)]
+        if (len(spikes) == 0):
+            #also covers snippets longer than the data, which cannot have a window view
+            return spikes/self._fs, np.zeros((0, before + after), dtype=np.asarray(self._data[:0]).dtype)
+        windows = np.lib.stride_tricks.sliding_window_view(self._data, before + after)
+        return spikes/self._fs, windows[spikes - before]
+
+    #downsampling function, resamples to self._fs/decim_factor (see resample); decim_factor does not have to be an integer
     #modifies self._fs, self._data, and if anti-aliasing filter is less than lowpass filter, self._filterfreq, and the time vector
-    def decim(self, decim_factor):
-        out_data = signal.decimate(self._data, decim_factor)
+    @_instrumented('Channel.decim', modifies = True)
+    def decim(self, decim_factor, chunk_size = None):
+        return self.resample(self._fs/decim_factor, chunk_size)
+
+    #resampling function, converts the data to the sampling rate fs_out with a polyphase FIR anti-aliasing filter
+    #fs_out may be any rational multiple of self._fs (e.g. 44100 Hz to 10000 Hz, see resample_ratio); the filter is designed once per ratio
+    #sample k of the result is at time k/fs_out, so event times in seconds stay aligned with the data
+    #chunk_size and out select the streaming mode for long recordings (see _resample_chunked)
+    @_instrumented('Channel.resample', modifies = True)
+    def resample(self, fs_out, chunk_size = None, out = None):
+        up, down = resample_ratio(self._fs, fs_out)
+        out_data = _resample(self._data, up, down, self._dtype, chunk_size, out)
+        return self._set_resampled(out_data, self._fs*up/down)
+
+    #stores data that has been resampled to fs_out and updates the sampling rate, filter frequencies and time vector
+    def _set_resampled(self, out_data, fs_out):
         self._data = out_data
-        new_fs = self._fs/decim_factor
-        self._fs = new_fs
-        if (self._filterfreqs[1] > (new_fs)/2):
-            self._filterfreqs[1]=new_fs/2 
-        self._t = np.arange(0, (len(self._data)/self._fs), (1/self._fs))
+        self._invalidate()
+        self._fs = fs_out
+        if (self._filterfreqs[1] > (fs_out)/2):
+            self._filterfreqs[1]=fs_out/2 
+        self._t = TimeAxis(len(self._data), self._fs)
         return self
 
-    def normalize(self, norm_type, norm_value = None):
+    #the mean and standard deviation are accumulated in float64, the result is stored in the compute precision
+    #if out is set, the result is written to out, which may be self._data itself to normalize without allocating a new array
+    @_instrumented('Channel.normalize', modifies = True)
+    def normalize(self, norm_type, norm_value = None, out = None):
         if (norm_type == 'mean'):
-            avg = np.mean(self._data)
-            out_data = self._data - avg
+            avg = np.mean(self._data, dtype=np.float64)
+            out_data = np.subtract(self._data, avg, out=out, dtype=self._dtype)
             self._data = out_data 
         elif (norm_type == "std"):
-            std_coeff = 1/(self.get_std())
-            out_data = np.multiply(self._data, std_coeff)
+            std_coeff = 1/(_chunked_std(np.asarray(self._data))[0])
+            out_data = np.multiply(self._data, std_coeff, out=out, dtype=self._dtype)
             self._data = out_data 
         elif (norm_type == "scalar"):
-            assert((isinstance(norm_value, float) or isinstance(norm_value, int)), "Must specify number for scalar")
+            assert isinstance(norm_value, numbers.Real), "Must specify number for scalar"
             #print(type(norm_value))
-            out_data = np.multiply(self._data, norm_value)
+            out_data = np.multiply(self._data, norm_value, out=out, dtype=self._dtype)
             self._data = out_data
         else: 
             raise Exception("Incorrect normalization type specified")
+        self._invalidate()
+        return self
+
+"""Events"""
+
+#reads a BYB events file into a dictionary of event label -> sorted numpy array of event times (in seconds)
+#the first two lines of the file are headers, every other line is "label, time"
+#labels are kept in the order they first appear in the file
+def read_events(eventspath):
+    with open(eventspath) as event_file:
+        lines = [line for line in event_file.read().splitlines()[2:] if line.strip() != '']
+    #all lines are split in one call; lines with extra commas fall back to splitting line by line
+    fields = ','.join(lines).split(',')
+    if (len(fields) != 2*len(lines)):
+        fields = [field for line in lines for field in line.split(',')[:2]]
+    labels = np.char.strip(np.array(fields[0::2], dtype=str))
+    times = np.array(fields[1::2], dtype=float)
+    return _group_events(labels, times)
+
+#groups event times by label with one sort instead of a Python loop over every event
+def _group_events(labels, times):
+    names, first_index, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.lexsort((times, inverse))
+    counts = np.bincount(inverse, minlength=len(names))
+    groups = np.split(times[order], np.cumsum(counts)[:-1])
+    return {str(names[i]): groups[i] for i in np.argsort(first_index)}
+
+"""Event-Triggered Averaging"""
+
+#running mean and variance of event-locked epochs, updated one batch of epochs at a time
+#batches are combined with the parallel form of Welford's algorithm, so epochs from many chunks, Sessions or worker
+#processes can be averaged without holding every trial in memory; NaN samples (see Session.epochs edge='nan') are skipped
+class EpochAverager:
+    def __init__(self):
+        self._count = None #number of epochs averaged at each sample
+        self._mean = None #running mean at each sample
+        self._m2 = None #running sum of squared deviations from the mean at each sample
+
+    def update(self, epochs):
+        '''
+        Add a batch of epochs to the running statistics.
+
+        Keyword Arguments:
+        epochs -- array of epochs with the epochs along the first axis, e.g. the output of Session.epochs (array)
+
+        Return:
+        the EpochAverager
+        '''
+        epochs = np.asarray(epochs, dtype=np.float64)
+        if (len(epochs) == 0):
+            return self
+        count = np.sum(~np.isnan(epochs), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(epochs, axis=0)/count, 0.0)
+        m2 = np.nansum((epochs - mean)**2, axis=0)
+        return self._combine(count, mean, m2)
+
+    def merge(self, other):
+        '''
+        Add the statistics of another EpochAverager, e.g. one computed on another Session or in another process.
+
+        Keyword Arguments:
+        other -- EpochAverager over epochs of the same shape (EpochAverager)
+
+        Return:
+        the EpochAverager
+        '''
+        if other._count is None:
+            return self
+        return self._combine(other._count, other._mean, other._m2)
+
+    def _combine(self, count, mean, m2):
+        if self._count is None:
+            self._count, self._mean, self._m2 = np.array(count), np.array(mean), np.array(m2)
+            return self
+        if (np.shape(count) != self._count.shape):
+            raise Exception(f"Epoch shape {np.shape(count)} does not match the averaged epochs {self._count.shape}")
+        total = self._count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(total > 0, count/total, 0.0)
+        delta = mean - self._mean
+        self._mean = self._mean + delta*fraction
+        self._m2 = self._m2 + m2 + delta**2*self._count*fraction
+        self._count = total
         return self
 
-fs = 44100       # sampling rate, Hz, must be integer
-duration = 1   # in seconds, may be float
-f1 = 10        # sine frequency, Hz, may be float
-f2 = 4       
-# generate samples, note conversion to float32 array
-data = (np.sin(2*np.pi*np.arange(fs*duration)*(f1)/fs)) + (np.sin(2*np.pi*np.arange(fs*duration)*(f2)/fs))
+    def get_count(self):
+        '''
+        Returns the number of epochs averaged at each sample (array).
+        '''
+        return self._count
 
-chan1 = Channel(data, fs)
-plt.plot(chan1._t, data)
-chan1.filt(7, 'hp', 2)
-plt.figure()
-plt.plot(chan1._t, chan1.get_data())
+    def get_mean(self):
+        '''
+        Returns the event-triggered average (array).
+        '''
+        return self._mean
+
+    def get_variance(self):
+        '''
+        Returns the sample variance across epochs (array). Samples with fewer than two epochs are NaN.
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self._count > 1, self._m2/(self._count - 1), np.nan)
+
+    def get_sem(self):
+        '''
+        Returns the standard error of the event-triggered average (array).
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.get_variance()/self._count)
+
+"""Plot Rendering"""
+
+#reduces samples first:last of a channel sampled at fs to a min/max envelope of npixels bins
+#the returned time and amplitude arrays alternate between the minimum and maximum of each bin, so a line plot
+#of the envelope looks like a plot of every sample, but its drawing cost depends on npixels instead of the interval length
+def _minmax_envelope(data, first, last, fs, npixels):
+    nsamples = last - first
+    if (nsamples <= 2*npixels):
+        return np.arange(first, last)/fs, np.asarray(data[first:last])
+    bin_starts = (np.arange(npixels)*nsamples)//npixels
+    segment = data[first:last]
+    mins = np.minimum.reduceat(segment, bin_starts)
+    maxs = np.maximum.reduceat(segment, bin_starts)
+    bin_edges = np.append(bin_starts, nsamples)
+    bin_times = (first + (bin_edges[:-1] + bin_edges[1:] - 1)/2)/fs
+    return np.repeat(bin_times, 2), np.column_stack((mins, maxs)).ravel()
+
+#width of the current figure in pixels, used as the number of envelope bins when plotting an interval
+def _figure_width_pixels():
+    fig = plt.gcf()
+    return int(fig.get_size_inches()[0]*fig.dpi)
+
+"""Spectral Analysis"""
+
+#splits nsamples into blocks of whole analysis windows (nperseg long, step samples apart) of about chunk_size samples
+#yields (start, stop, nwindows) for each block; the windows of all blocks are exactly the windows of the whole data
+def _window_blocks(nsamples, nperseg, step, chunk_size):
+    nwindows = 1 + (nsamples - nperseg)//step
+    block_windows = max(chunk_size//step, 1)
+    for first_window in range(0, nwindows, block_windows):
+        count = min(block_windows, nwindows - first_window)
+        start = first_window*step
+        yield start, start + (count - 1)*step + nperseg, count
+
+#segment length and overlap for analysing nsamples samples: nperseg is clamped to the data, then noverlap defaults to
+#nperseg//overlap_divisor (2 for Welch estimates, 8 for spectrograms, as in scipy.signal) and must be from 0 to nperseg - 1
+def _segment_parameters(nsamples, nperseg, noverlap, overlap_divisor):
+    if (nsamples < 1):
+        raise Exception("The interval contains no samples.")
+    if (nperseg < 1):
+        raise Exception("nperseg must be a positive number of samples.")
+    nperseg = min(int(nperseg), nsamples)
+    noverlap = nperseg//overlap_divisor if noverlap is None else int(noverlap)
+    if not (0 <= noverlap < nperseg):
+        raise Exception(f"noverlap must be at least 0 and less than nperseg ({nperseg}), got {noverlap}.")
+    return nperseg, noverlap
+
+#sum over the Welch segments of data (shape (..., channels, samples)) of the cross spectra X_i conj(X_j) of every channel pair
+#segments are nperseg long and step samples apart, with their mean removed and multiplied by taper, as in signal.csd
+#returns a (channels x channels x frequencies) array and the number of segments
+def _cross_spectra(data, taper, step):
+    nperseg = len(taper)
+    segments = np.lib.stride_tricks.sliding_window_view(data, nperseg, axis=-1)[..., ::step, :]
+    segments = (segments - np.mean(segments, axis=-1, keepdims=True))*taper
+    spectra = np.moveaxis(fft.rfft(segments, axis=-1), -3, 0)
+    spectra = spectra.reshape(len(spectra), -1, spectra.shape[-1])
+    return np.einsum('isf,jsf->ijf', spectra.conj(), spectra), spectra.shape[1]
 
 """Session Class"""
 
+#True if arrays a and b are the same view of the same memory (same start, shape, strides and dtype)
+def _same_view(a, b):
+    return (isinstance(a, np.ndarray) and a.shape == b.shape and a.strides == b.strides and a.dtype == b.dtype
+            and a.__array_interface__['data'][0] == b.__array_interface__['data'][0])
+
+#the array that owns the memory of the view a (e.g. the np.memmap of a mapped file)
+def _memory_owner(a):
+    while isinstance(a.base, np.ndarray):
+        a = a.base
+    return a
+
+#read-only (rows x samples) view of the 1-D arrays datas if they are equally spaced rows of the same memory,
+#e.g. the channels of a memory-mapped WAV file, so they can be handled as one block without reading them; otherwise None
+def _rows_view(datas):
+    first = datas[0]
+    if not all(isinstance(d, np.ndarray) and (d.ndim == 1) and (d.shape == first.shape) and (d.strides == first.strides)
+               and (d.dtype == first.dtype) and (_memory_owner(d) is _memory_owner(first)) for d in datas):
+        return None
+    addresses = [d.__array_interface__['data'][0] for d in datas]
+    row_stride = (addresses[1] - addresses[0]) if (len(datas) > 1) else 0
+    if any(address - addresses[0] != i*row_stride for i, address in enumerate(addresses)):
+        return None
+    return np.lib.stride_tricks.as_strided(first, shape = (len(datas), len(first)), strides = (row_stride, first.strides[0]), writeable = False)
+
 class Session: 
 
-    def __init__(self, datapath = "", eventspath = ""):
+    @_instrumented('Session.load', modifies = True)
+    def __init__(self, datapath = "", eventspath = "", mmap = False, dtype = None, workers = None):
+        '''
+        Create a Session object from a BYB WAV recording.
+
+        Keyword Arguments:
+        datapath -- path to the WAV file (string)
+        eventspath -- path to the events file, or 'y' to use the "<datapath>-events.txt" sidecar (string)
+        mmap -- if True, the WAV file is memory-mapped instead of read into memory (Boolean). Default value is False.
+                Each Channel then holds a zero-copy view of the mapped file and samples are only read from disk
+                when an interval is accessed. Mapped data is read-only; processing methods return new arrays.
+        dtype -- precision of filtering, decimation, normalization and epoching, np.float64 or np.float32 (numpy dtype).
+                 Default is np.float64. With np.float32 processed data takes half the memory of float64 (see set_dtype).
+        workers -- number of threads that process channels concurrently (int). Default is None, which processes them one after another (see set_workers).
+        '''
+        self._mmap = mmap
+        self._dtype = np.dtype(dtype if dtype is not None else np.float64)
+        self.set_workers(workers)
         if (datapath != ""):
             self._datapath = datapath
             if (eventspath == "y"):
@@ -190,38 +1240,142 @@ class Session:
         #reading data from file
         if (self._datapath != None):
             try:
-                sample_rate, data = wavfile.read(self._datapath)
+                sample_rate, data = wavfile.read(self._datapath, mmap = self._mmap)
                 self._samplerate = sample_rate
                 self._channeldata = data
-                self._nchannels = np.ndim(data)
+                self._nchannels = data.shape[1] if (np.ndim(data) > 1) else 1
                 print(self._nchannels)
                 self._channels = []
                 if (self._nchannels == 1):
-                    add_channel = Channel(data = self._channeldata, fs= self._samplerate)
+                    add_channel = Channel(data = self._channeldata, fs= self._samplerate, dtype = self._dtype)
+                    add_channel._source = (self._datapath, 0)
                     self._channels.append(add_channel)
                 else: 
+                    #WAV samples are interleaved; channels are stored as one contiguous (channels x samples) buffer so that
+                    #each Channel is a contiguous row and later operations can work on the buffer in place (see _writable_block).
+                    #Memory-mapped data stays a strided view so that samples are still only read when accessed
                     self._channeldata = np.transpose(self._channeldata)
+                    if not self._mmap:
+                        self._channeldata = np.ascontiguousarray(self._channeldata)
                     for i in range(self._nchannels): 
-                        add_channel = Channel(data = self._channeldata[i], fs= self._samplerate)
+                        add_channel = Channel(data = self._channeldata[i], fs= self._samplerate, dtype = self._dtype)
+                        add_channel._source = (self._datapath, i)
                         self._channels.append(add_channel) 
             except: 
                print("Incorrect filename specified.")
         if (self._eventspath != None):
-            with open(self._eventspath) as event_file:
-                timestamps = event_file.readlines()
-                timestamps = timestamps[2:]
-                events = {}
-                for timestamp in timestamps:
-                    event = timestamp[0]
-                    if event not in events:
-                        events[event] = [float(timestamp.split(',')[1])]
-                    elif event in events:
-                        temp = events[event]
-                        to_add = timestamp.split(',')
-                        to_add = float(to_add[1])
-                        temp.append(to_add)
-                        events[event] = temp
-            self._events = events 
+            self._events = read_events(self._eventspath)
+        else:
+            self._events = {}
+
+    @_instrumented('Session.save')
+    def save(self, path, dtype = None, chunk_size = 2**20):
+      '''
+      Save the Session, with its processed channel data, to a directory that Session.open can memory-map.
+      The directory holds the channel data as .npy arrays (written chunk_size samples at a time), the events as an .npz file,
+      and the sampling rates, filter frequencies, labels, colors and session metadata (sessionID, subject, datetime) as JSON.
+
+      Keyword Arguments:
+      path -- directory to save the Session to; it is created if needed (string)
+      dtype -- if set, the channel data is stored with this dtype, e.g. np.float32 to halve the file size (numpy dtype)
+      chunk_size -- number of samples copied at a time (int)
+
+      Return:
+      the path the Session was saved to
+      '''
+      os.makedirs(path, exist_ok = True)
+      block = self._channel_block()
+      #channels of equal length and fs are stored as one (channels x samples) array, otherwise one array per channel
+      arrays = {'channels.npy': block} if block is not None else {f'channel{i}.npy': chan.get_data() for i, chan in enumerate(self._channels)}
+      #every file is written next to its target and then moved over it, so a Session opened (memory-mapped) from path
+      #can be saved back to path: its data stays readable from the replaced files until the new ones are complete
+      for filename, data in arrays.items():
+          data = np.asarray(data)
+          stored = np.lib.format.open_memmap(os.path.join(path, filename + '.tmp'), mode = 'w+', dtype = dtype if dtype is not None else data.dtype, shape = data.shape)
+          for start in range(0, data.shape[-1], chunk_size):
+              stored[..., start:start + chunk_size] = data[..., start:start + chunk_size]
+          stored.flush()
+          del stored
+          os.replace(os.path.join(path, filename + '.tmp'), os.path.join(path, filename))
+      #event labels can be any string (e.g. 'file', which np.savez reserves), so the arrays are stored under generated keys
+      event_labels = list(getattr(self, '_events', {}))
+      with open(os.path.join(path, 'events.npz.tmp'), 'wb') as events_file:
+          np.savez(events_file, **{f'event{i}': self._events[label] for i, label in enumerate(event_labels)})
+      os.replace(os.path.join(path, 'events.npz.tmp'), os.path.join(path, 'events.npz'))
+
+      session_datetime = getattr(self, '_datetime', None)
+      #Sessions assembled with set_channels have no WAV sampling rate, so the rate of the channels is stored
+      samplerate = getattr(self, '_samplerate', None)
+      if (samplerate is None) and (len(self._channels) > 0):
+          samplerate = self._channels[0].get_fs()
+      metadata = {
+          'datapath': getattr(self, '_datapath', None),
+          'eventspath': getattr(self, '_eventspath', None),
+          'samplerate': samplerate,
+          'nchannels': len(self._channels),
+          'arrays': list(arrays),
+          'events': event_labels,
+          'filterfreqs': getattr(self, '_filterfreqs', None),
+          'dtype': self._dtype.name,
+          'sessionID': getattr(self, '_sessionID', None),
+          'subject': getattr(self, '_subject', None),
+          'datetime': session_datetime.isoformat() if isinstance(session_datetime, datetime) else session_datetime,
+          'datetime_is_datetime': isinstance(session_datetime, datetime),
+          'channels': [{'fs': chan.get_fs(), 'filterfreqs': chan.get_filterfreqs(), 'label': chan.get_label(), 'color': chan.get_color()}
+                       for chan in self._channels],
+      }
+      with open(os.path.join(path, 'session.json.tmp'), 'w') as metadata_file:
+          json.dump(metadata, metadata_file, indent = 1, default = lambda value: value.item() if isinstance(value, np.generic) else str(value))
+      os.replace(os.path.join(path, 'session.json.tmp'), os.path.join(path, 'session.json'))
+      return path
+    @classmethod
+    @_instrumented('Session.open')
+    def open(cls, path, mmap = True, dtype = None):
+      '''
+      Open a Session saved with Session.save.
+      With mmap the channel data is memory-mapped, so opening takes the same short time for any recording length.
+
+      Keyword Arguments:
+      path -- directory the Session was saved to (string)
+      mmap -- if True, the channel data is memory-mapped (read-only) instead of read into memory (Boolean). Default value is True.
+      dtype -- if set, overrides the compute precision the Session was saved with (numpy dtype)
+
+      Return:
+      the Session object
+
+      Example: Session1 = Session.open("BYB_Recording_2021-06-18_16.14.32.session")
+      '''
+      with open(os.path.join(path, 'session.json')) as metadata_file:
+          metadata = json.load(metadata_file)
+      session = cls.__new__(cls)
+      session._mmap = mmap
+      session.set_workers(None)
+      session._dtype = np.dtype(dtype if dtype is not None else metadata.get('dtype', 'float64'))
+      session._datapath = metadata['datapath']
+      session._eventspath = metadata['eventspath']
+      session._samplerate = metadata['samplerate']
+      session._nchannels = metadata['nchannels']
+      arrays = [np.load(os.path.join(path, filename), mmap_mode = 'r' if mmap else None) for filename in metadata['arrays']]
+      if (metadata['arrays'] == ['channels.npy']):
+          session._channeldata = arrays[0] if (session._nchannels > 1) else arrays[0][0]
+          datas = list(arrays[0])
+      else:
+          session._channeldata = arrays
+          datas = arrays
+      session._channels = [Channel(data = data, fs = chan['fs'], filterfreqs = chan['filterfreqs'], label = chan['label'], color = chan['color'], dtype = session._dtype)
+                           for data, chan in zip(datas, metadata['channels'])]
+      with np.load(os.path.join(path, 'events.npz')) as events:
+          if 'events' in metadata:
+              session._events = {label: events[f'event{i}'] for i, label in enumerate(metadata['events'])}
+          else:
+              #saved before the event arrays were stored under generated keys
+              session._events = {label: events[label] for label in events.files}
+      for key in ('filterfreqs', 'sessionID', 'subject'):
+          if metadata[key] is not None:
+              setattr(session, '_' + key, metadata[key])
+      if metadata['datetime'] is not None:
+          session._datetime = datetime.fromisoformat(metadata['datetime']) if metadata['datetime_is_datetime'] else metadata['datetime']
+      return session
 
     #getter object for Session class
     def get_nchannels(self): #returns number of channels
@@ -237,6 +1391,7 @@ class Session:
     def get_channeldata(self):#returns channel data in array
       ''' 
       Returns a numpy array of all the channel data in a Session object. 
+      This is the buffer the channels are views of, so Session operations that work in place also change it.
       '''
       return self._channeldata 
     def get_channel(self, channelindex):#returns specific channel object
@@ -295,11 +1450,42 @@ class Session:
       These are specified by the user
       '''
       return self._filterfreqs 
+    def get_dtype(self):
+      '''
+      Returns the compute precision of the Session (see set_dtype).
+      '''
+      return self._dtype
+    def get_workers(self):
+      '''
+      Returns the number of worker threads of the Session, or None if channels are processed one after another (see set_workers).
+      '''
+      return self._workers
     def get_events(self):
       '''
       Returns a dictionary containing the events of a Session if they exist.  
+      Each event label maps to a sorted numpy array of event times in seconds.
       '''
       return self._events
+    def get_events_interval(self, left_bound, right_bound, event = None):
+      '''
+      Returns the event times that fall inside an interval of the Session.
+      The sorted event arrays are searched with np.searchsorted, so each lookup costs O(log n) in the number of events.
+
+      Keyword Arguments:
+      left_bound -- start of the interval in seconds, inclusive (float)
+      right_bound -- end of the interval in seconds, inclusive (float)
+      event -- if set, only the times of this event label are returned (string)
+
+      Return:
+      a numpy array of event times if event is set, otherwise a dictionary of event label -> numpy array of event times
+
+      Example: Session1.get_events_interval(10, 20, '1')
+      returns: times of event '1' between 10 and 20 seconds
+      '''
+      if event is not None:
+          times = self._events[event]
+          return times[np.searchsorted(times, left_bound, 'left'):np.searchsorted(times, right_bound, 'right')]
+      return {label: self.get_events_interval(left_bound, right_bound, label) for label in self._events}
     
     
     #setter object for Session class
@@ -325,13 +1511,13 @@ class Session:
       Return:
       a list of all channels attached to the Session object
       '''
-      if (len(channels)!= self._nchannels):
+      if (len(channels)!= getattr(self, '_nchannels', None)):
           self._nchannels = len(channels)
       self._channels = channels
-      channeldata = []
-      for chan in channels:
-          channeldata.append(chan.get_data())
-      self._channeldata = channeldata 
+      self._channeldata = [chan.get_data() for chan in channels]
+      #channels of equal length and fs are stored as one (channels x samples) array whose rows are the channels' data:
+      #a view of the file for memory-mapped channels when possible, otherwise a contiguous buffer (see _channel_block)
+      self._channel_block()
       return self._channels
     def set_datapath(self, datapath, construct = True):
       '''
@@ -346,7 +1532,7 @@ class Session:
       '''
       self._datapath = datapath 
       if construct: 
-           self.__init__(self._datapath)
+           self.__init__(self._datapath, mmap = self._mmap, dtype = self._dtype, workers = self._workers)
       return self._datapath
     def set_eventspath(self, eventspath, construct = False):
       '''
@@ -361,7 +1547,7 @@ class Session:
       '''
       self._eventspath = eventspath
       if construct:
-          self.__init__(datapath=self._datapath, eventspath = self._eventspath)
+          self.__init__(datapath=self._datapath, eventspath = self._eventspath, mmap = self._mmap, dtype = self._dtype, workers = self._workers)
       return self._datapath
     def set_sessionID(self, sessionID):
       '''
@@ -433,36 +1619,134 @@ class Session:
       '''
       self._filterfreqs = filterfreqs
       return self._filterfreqs 
+    def set_dtype(self, dtype):
+      '''
+      Set the compute precision of the Session and all of its channels.
+      Filtering (including the filter coefficients), decimation, normalization and epoching produce data of this dtype;
+      integer WAV data is converted once, by the first operation. Means and standard deviations are always accumulated in float64.
+
+      Keyword Arguments:
+      dtype -- np.float64, or np.float32 to halve the memory of processed data (numpy dtype)
+
+      Return:
+      the compute precision set for the Session object
+
+      Example: Session1.set_dtype(np.float32)
+      '''
+      for chan in self._channels:
+          chan.set_dtype(dtype)
+      self._dtype = np.dtype(dtype)
+      return self._dtype
+    def set_workers(self, workers):
+      '''
+      Set the number of threads used to filter, decimate, normalize, detect spikes and compute standard deviations.
+      Channels are processed concurrently, and elementwise normalization also splits each channel into time chunks;
+      scipy releases the GIL while it filters, so the threads run on separate cores. Every channel is computed exactly
+      as on the serial path and results are assembled in channel order, so they are identical for any number of workers.
+      Filtering a single channel is not split in time, because each sample of a recursive filter depends on the ones before it.
+
+      Keyword Arguments:
+      workers -- number of threads (int), or None to process channels one after another
+
+      Return:
+      the number of workers set for the Session object
+
+      Example: Session1.set_workers(os.cpu_count())
+      '''
+      executor = getattr(self, '_executor', None)
+      if executor is not None:
+          executor.shutdown()
+      self._workers = workers
+      self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers) if (workers is not None and workers > 1) else None
+      return self._workers
+    def _map(self, function, items):
+      '''
+      Returns [function(item) for item in items], computed on the Session worker threads if there are any (see set_workers).
+      '''
+      if self._executor is None:
+          return [function(item) for item in items]
+      return list(self._executor.map(function, items))
     def set_events(self, events):
       '''
       Set the events for the Session object.
 
       Keyword Arguments:
-      events -- the events to attatch to the Session object (list: obj)
+      events -- the events to attatch to the Session object, event label -> list of event times in seconds (dict)
 
       Return:
       the events set for the Session object
       '''
-      self._events = events
+      self._events = {label: np.sort(np.asarray(times, dtype=float)) for label, times in events.items()}
       return self._events
-    def _filt (self, cutoff, ftype, filter_order = 2, channel_index = None):
+    def _filt (self, cutoff, ftype, filter_order = 2, channel_index = None, chunk_size = None, out = None):
       '''
       Filter the channel data in the Session object inplace.
+      With chunk_size and out, a recording larger than memory (e.g. opened with mmap=True) is read from and written to disk
+      chunk_size samples at a time, and the Session data becomes out.
 
       Keyword Arguments:
       cutoff -- cutoff frequency (int)
       ftype -- low or high-pass filter (string)
       filter_order -- filter order (int)
       channel_index -- if set, filters only the chosen channel_index (int)
+      chunk_size -- if set, filters each channel chunk_size samples at a time to bound memory use (int)
+      out -- if set, the result is written to this array, e.g. a disk-backed np.memmap (array). Its shape is (channels x samples),
+             or (samples,) if channel_index is set. Default is to filter in place when possible, otherwise into a new array.
+
+      Example: Session1._filt(300, 'hp', chunk_size=2**20, out=np.lib.format.open_memmap("filtered.npy", mode='w+', dtype=np.float32, shape=(2, nsamples)))
+      '''
+      self._filt_stages([(cutoff, ftype, filter_order)], channel_index, chunk_size, out)
+    @_instrumented('Session.filt', modifies = True)
+    def _filt_stages(self, stages, channel_index = None, chunk_size = None, out = None):
+      '''
+      Filter the channel data in the Session object inplace with a cascade of filter stages (see FilterPipeline).
+
+      Keyword Arguments:
+      stages -- list of (cutoff, ftype, filter_order) stages
+      channel_index -- if set, filters only the chosen channel_index (int)
+      chunk_size -- if set, filters each channel chunk_size samples at a time to bound memory use (int)
+      out -- if set, the array the result is written to, e.g. a disk-backed np.memmap (see _filt)
       '''
       if (channel_index == None): 
+          block = self._channel_block()
+          if block is None:
+              if out is not None:
+                  raise Exception("out can only be used when all channels have the same length and sampling rate.")
+              self._map(lambda chan: chan._filt_stages(stages, chunk_size), self._channels)
+              return
+          if (out is not None) and (np.shape(out) != block.shape):
+              raise Exception(f"out must have shape {block.shape} (channels x samples), not {np.shape(out)}.")
+          #all channels share fs, so one design filters the whole block along the sample axis
+          sos = self._channels[0]._design_stages(stages)
+          if (self._executor is not None) and (len(block) > 1):
+              #one task per channel; filtering a row gives the same result as filtering the block along its last axis
+              if out is None:
+                  out = self._writable_block(block) if (chunk_size is not None) else None
+                  out = out if out is not None else np.empty(block.shape, dtype=self._dtype)
+              self._map(lambda i: _sosfiltfilt(sos, block[i], self._dtype, chunk_size, out[i]), range(len(block)))
+              self._set_block(out)
+          elif chunk_size is None:
+              self._set_block(_sosfiltfilt(sos, block, self._dtype, out = out))
+          else:
+              #the chunked filter can overwrite its input, so the buffer is filtered in place when possible
+              out = out if out is not None else self._writable_block(block)
+              self._set_block(_sosfiltfilt_chunked(sos, block, chunk_size, out, self._dtype))
           for chan in self._channels:
-              filted_chan = chan.filt(cutoff, ftype, filter_order)
-              self._channels[channel_index] = filted_chan
+              chan._record_stages(stages)
       else: 
-          chan_to_filt = self._channels[channel_index]
-          filtered_chan = chan_to_filt.filt(cutoff, ftype, filter_order)
-          self._channels[channel_index] = filtered_chan 
+          if (out is not None) and (np.shape(out) != np.shape(self._channels[channel_index].get_data())):
+              raise Exception(f"out must have the shape of the channel data, {np.shape(self._channels[channel_index].get_data())}.")
+          self._channels[channel_index]._filt_stages(stages, chunk_size, out if out is not None else self._writable_row(channel_index))
+    def pipeline(self, channel_index = None):
+      '''
+      Returns a FilterPipeline that collects filter stages and applies them in one pass over the data.
+
+      Keyword Arguments:
+      channel_index -- if set, the pipeline filters only the chosen channel (int)
+
+      Example: Session1.pipeline().filt(300,'hp').filt(60,'n').filt(3000,'lp').apply()
+      '''
+      return FilterPipeline(self, channel_index)
     def _get_std(self, interval=[0,0], channel_index=None):
       '''
       Get the standard deviation of the data in the Session object.
@@ -475,28 +1759,168 @@ class Session:
       the standard deviation calculated
       '''
       if (channel_index == None):
-          std_vec = []
-          for chan in self._channels:
-              std_vec.append(chan.get_std(interval))
-          return std_vec
+          return self._map(lambda chan: chan.get_std(interval), self._channels)
       else: 
           return self._channels[channel_index].get_std(interval)
-    def _decim(self, decim_factor, channel_index=None):
+    @_instrumented('Session.rolling_stats')
+    def rolling_stats(self, window, step = None, stats = ('mean', 'std', 'rms', 'peak'), channels = None):
+      '''
+      Compute windowed statistics of the data for several channels at once (see Channel.rolling_stats).
+      The mean, standard deviation and RMS come from prefix sums cached on each channel, so windows of any length
+      and overlap cost the same; 'min', 'max' and 'peak' (max |x|, the peak envelope) come from running min/max filters.
+
+      Keyword Arguments:
+      window -- window length in seconds (float)
+      step -- time between the starts of consecutive windows in seconds (float). Default is window, i.e. no overlap.
+      stats -- statistics to compute, any of 'mean', 'std', 'rms', 'min', 'max' and 'peak' (list: string)
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+
+      Return:
+      (times, stats) where times are the window centers in seconds and stats maps each statistic to an array of shape (channels x windows)
+
+      Example: times, envelope = Session1.rolling_stats(0.05, 0.01, ['rms'])
       '''
-      Downsample the data in the Session object inplace.
+      if channels is None:
+          channels = list(range(len(self._channels)))
+      elif isinstance(channels, (int, np.integer)):
+          channels = [channels]
+      chosen_channels = [self._channels[i] for i in channels]
+      if any(chan.get_fs() != chosen_channels[0].get_fs() for chan in chosen_channels):
+          raise Exception("All channels must have the same sampling rate.")
+      results = self._map(lambda chan: chan.rolling_stats(window, step, stats), chosen_channels)
+      nwindows = min(len(times) for times, _ in results)
+      return results[0][0][:nwindows], {stat: np.stack([values[stat][:nwindows] for _, values in results]) for stat in stats}
+    @_instrumented('Session.detect_spikes')
+    def _detect_spikes(self, threshold = 5, noise = 'mad', direction = 'neg', refractory = 0.001, snippet = (0.0005, 0.001), chunk_size = None, channel_index = None):
+      '''
+      Detect spikes as threshold crossings of the data in the Session object (see Channel.detect_spikes).
+
+      Keyword Arguments:
+      threshold -- threshold as a multiple of the noise level (float)
+      noise -- noise estimate per chunk, 'mad' for median(|x|)/0.6745 or 'std' (string)
+      direction -- 'neg', 'pos' or 'both' (string)
+      refractory -- minimum time between spikes in seconds (float)
+      snippet -- time before and after each spike to extract, in seconds (tuple: float)
+      chunk_size -- number of samples processed at a time, and over which the noise is estimated (int). Default is 10 seconds.
+      channel_index -- if set, detects spikes only on the chosen channel (int)
+
+      Return:
+      (spike times in seconds, waveform snippets) for the chosen channel, or a list of them for every channel
+      '''
+      if (channel_index == None):
+          return self._map(lambda chan: chan.detect_spikes(threshold, noise, direction, refractory, snippet, chunk_size), self._channels)
+      else:
+          return self._channels[channel_index].detect_spikes(threshold, noise, direction, refractory, snippet, chunk_size)
+    def _channel_block(self):
+      '''
+      Returns the data of all channels as one (channels x samples) array whose rows are the channels' data,
+      so Session operations can process every channel in a single call along the last axis.
+      The stored channel data is used without copying while the Channel objects still hold views onto it, and memory-mapped
+      channels that are rows of the same file are combined into a view of it (see _rows_view);
+      otherwise the channels are stacked into a new array once and re-attached as views (see _set_block).
+
+      Return:
+      a (channels x samples) array, or None if the channels differ in length or sampling rate
+      '''
+      datas = [chan.get_data() for chan in self._channels]
+      if (len(datas) == 0) or (len(set(len(d) for d in datas)) != 1) or (len(set(chan.get_fs() for chan in self._channels)) != 1):
+          return None
+      block = self._channeldata
+      if isinstance(block, np.ndarray):
+          if (np.ndim(block) == 1):
+              block = block[np.newaxis, :]
+          if (block.shape == (len(datas), len(datas[0]))) and all(_same_view(d, row) for d, row in zip(datas, block)):
+              return block
+      if self._mmap:
+          block = _rows_view(datas)
+          if block is not None:
+              self._channeldata = block if (len(self._channels) > 1) else block[0]
+              return block
+      block = np.stack([np.asarray(d) for d in datas])
+      self._channeldata = block if (len(self._channels) > 1) else block[0]
+      for i, chan in enumerate(self._channels):
+          chan._data = block[i]
+      return block
+    def _writable_block(self, block):
+      '''
+      Returns block if results can be written into it in place, i.e. it is a writable array in the compute precision
+      that is not a memory-mapped file; otherwise returns None and a new array is allocated for the result.
+      '''
+      if isinstance(block, np.ndarray) and block.flags.writeable and (block.dtype == self._dtype) and not isinstance(block, np.memmap):
+          return block
+      return None
+    def _writable_row(self, channel_index):
+      '''
+      Returns the row of the channel data buffer of a channel if it can be written in place (see _writable_block), otherwise None.
+      '''
+      block = self._channel_block()
+      if (block is None) or (self._writable_block(block) is None):
+          return None
+      return block[channel_index]
+    def _set_block(self, block):
+      '''
+      Store a processed (channels x samples) array as the Session channel data and point every Channel at its row.
+      '''
+      self._channeldata = block if (len(self._channels) > 1) else block[0]
+      for i, chan in enumerate(self._channels):
+          chan._data = block[i]
+          chan._invalidate()
+    @_instrumented('Session.decim', modifies = True)
+    def _decim(self, decim_factor, channel_index=None, chunk_size = None):
+      '''
+      Downsample the data in the Session object inplace, by resampling each channel to its sampling rate divided by decim_factor (see resample).
 
       Keyword Arguments:
-      decim_factor -- the factor to decimate by (int)
+      decim_factor -- the factor to decimate by (int or float)
       channel_index -- if set, decimates only the chosen index (int)
+      chunk_size -- if set, resamples chunk_size samples at a time to bound memory use (int)
       '''
       if (channel_index == None): 
-          for chan in self._channels:
-              decim_chan = chan.decim(decim_factor)
-              self._channels[channel_index] = decim_chan
+          if self._channel_block() is None:
+              self._map(lambda chan: chan.decim(decim_factor, chunk_size), self._channels)
+              self._samplerate = self._channels[0].get_fs()
+          else:
+              self.resample(self._channels[0].get_fs()/decim_factor, chunk_size = chunk_size)
       else: 
           chan_to_decim = self._channels[channel_index]
-          decimated_chan = chan_to_decim.decim(decim_factor)
+          decimated_chan = chan_to_decim.decim(decim_factor, chunk_size)
           self._channels[channel_index] = decimated_chan
+    @_instrumented('Session.resample', modifies = True)
+    def resample(self, fs_out, channel_index = None, chunk_size = None):
+      '''
+      Resample the data in the Session object inplace to the sampling rate fs_out, with a polyphase FIR anti-aliasing filter.
+      fs_out may be any rational multiple of the sampling rate, e.g. 44100 Hz to 10000 Hz (see resample_ratio), and the filter
+      is designed once per ratio (see design_resampler). All channels are resampled in one call, or one task per channel
+      with worker threads (see set_workers). Sample k of the result is at time k/fs_out, so events stay aligned with the data.
+
+      Keyword Arguments:
+      fs_out -- the new sampling rate in Hz (int or float)
+      channel_index -- if set, resamples only the chosen channel (int)
+      chunk_size -- if set, resamples chunk_size samples at a time to bound memory use (int)
+
+      Return:
+      the new sampling rate
+
+      Example: Session1.resample(10000)
+      '''
+      if (channel_index == None):
+          block = self._channel_block()
+          if block is None:
+              self._map(lambda chan: chan.resample(fs_out, chunk_size), self._channels)
+          else:
+              fs_in = self._channels[0].get_fs()
+              up, down = resample_ratio(fs_in, fs_out)
+              if (self._executor is not None) and (len(block) > 1):
+                  self._set_block(np.stack(self._map(lambda row: _resample(row, up, down, self._dtype, chunk_size), block)))
+              else:
+                  self._set_block(_resample(block, up, down, self._dtype, chunk_size))
+              for chan in self._channels:
+                  chan._set_resampled(chan.get_data(), fs_in*up/down)
+          self._samplerate = self._channels[0].get_fs()
+          return self._samplerate
+      else:
+          return self._channels[channel_index].resample(fs_out, chunk_size).get_fs()
+    @_instrumented('Session.normalize', modifies = True)
     def _normalize(self, norm_type, norm_value = None, channel_index = None):
       '''
       Normalize the data in the Session object inplace.
@@ -507,17 +1931,429 @@ class Session:
       channel_index -- if set, only normalize the chosen channel (int)
       '''
       if (channel_index == None):
-          for chan in self._channels:
-              norm_chan = chan.normalize(norm_type, norm_value)
-              self._channels[channel_index] = norm_chan
+          block = self._channel_block()
+          if block is None:
+              self._map(lambda chan: chan.normalize(norm_type, norm_value), self._channels)
+          elif (self._executor is not None):
+              self._set_block(self._normalize_parallel(block, norm_type, norm_value, self._writable_block(block)))
+          elif (norm_type == 'mean'):
+              self._set_block(np.subtract(block, np.mean(block, axis=-1, keepdims=True, dtype=np.float64), out=self._writable_block(block), dtype=self._dtype))
+          elif (norm_type == "std"):
+              self._set_block(np.multiply(block, 1/_chunked_std(block), out=self._writable_block(block), dtype=self._dtype))
+          elif (norm_type == "scalar"):
+              assert isinstance(norm_value, numbers.Real), "Must specify number for scalar"
+              self._set_block(np.multiply(block, norm_value, out=self._writable_block(block), dtype=self._dtype))
+          else:
+              raise Exception("Incorrect normalization type specified")
+      elif (self._executor is not None):
+          chan_to_norm = self._channels[channel_index]
+          row = self._writable_row(channel_index)
+          chan_to_norm._data = self._normalize_parallel(np.asarray(chan_to_norm.get_data())[np.newaxis], norm_type, norm_value,
+                                                        None if row is None else row[np.newaxis])[0]
+          chan_to_norm._invalidate()
       else: 
           chan_to_norm = self._channels[channel_index]
-          normalized_chan = chan_to_norm.normalize(norm_type, norm_value)
+          normalized_chan = chan_to_norm.normalize(norm_type, norm_value, self._writable_row(channel_index))
           self._channels[channel_index] = normalized_chan 
               
 
+    def _normalize_parallel(self, block, norm_type, norm_value = None, out = None, chunk_size = 2**20):
+      '''
+      Normalize a (channels x samples) block on the Session worker threads (see _normalize).
+      The mean or standard deviation of each channel is computed in one task per channel, exactly as on the serial path,
+      and the elementwise subtraction or scaling runs in tasks of chunk_size samples.
+
+      Return:
+      the normalized block, written to out if it is set
+      '''
+      if (norm_type == 'mean'):
+          stats = self._map(lambda row: np.mean(row, dtype=np.float64), block)
+          operation = np.subtract
+      elif (norm_type == "std"):
+          stats = [1/std for std in self._map(lambda row: _chunked_std(row)[0], block)]
+          operation = np.multiply
+      elif (norm_type == "scalar"):
+          assert isinstance(norm_value, numbers.Real), "Must specify number for scalar"
+          stats = [norm_value]*len(block)
+          operation = np.multiply
+      else:
+          raise Exception("Incorrect normalization type specified")
+      out = out if out is not None else np.empty(block.shape, dtype=self._dtype)
+      def apply_chunk(task):
+          i, start = task
+          operation(block[i, start:start + chunk_size], stats[i], out=out[i, start:start + chunk_size], dtype=self._dtype)
+      self._map(apply_chunk, [(i, start) for i in range(len(block)) for start in range(0, block.shape[-1], chunk_size)])
+      return out
+    @_instrumented('Session.epochs')
+    def epochs(self, event, lbound, rbound, channels = None, edge = 'drop'):
+      '''
+      Returns all event-locked windows of the data as one array, without a Python loop over the events.
+      Windows are gathered from a strided view of the channel data (np.lib.stride_tricks.sliding_window_view).
+
+      Keyword Arguments:
+      event -- label of the event the windows are locked to (string)
+      lbound -- time before each event to include, in seconds (float)
+      rbound -- time after each event to include, in seconds (float)
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      edge -- windows that extend past the start or end of the data are left out if 'drop',
+              or kept and padded with NaN if 'nan' (string). Default value is 'drop'.
+
+      Return:
+      array of shape (events x channels x samples) in the compute precision (see set_dtype), with round((lbound + rbound)*fs) samples per window
+
+      Example: Session1.epochs('1', 0.1, 0.5, channels=[0, 1])
+      '''
+      return self._epochs_at(self._events[event], lbound, rbound, channels, edge)
+    def _epochs_at(self, times, lbound, rbound, channels = None, edge = 'drop'):
+      '''
+      Returns the windows locked to an array of times in seconds (see epochs).
+      '''
+      if channels is None:
+          channels = list(range(len(self._channels)))
+      elif isinstance(channels, (int, np.integer)):
+          channels = [channels]
+      chosen_channels = [self._channels[i] for i in channels]
+      fs = chosen_channels[0].get_fs()
+      if any(chan.get_fs() != fs for chan in chosen_channels):
+          raise Exception("All channels of an epoch must have the same sampling rate.")
+      nsamples = int(round((lbound + rbound)*fs))
+      starts = np.floor((np.asarray(times, dtype=float) - lbound)*fs).astype(np.int64)
+      block = self._channel_block()
+      #channels of different lengths are not one block, so their windows are gathered from each channel's own data;
+      #a window is inside the data only if it fits in every chosen channel, i.e. in the shortest one
+      rows = [block[i] for i in channels] if (block is not None) else [chan.get_data() for chan in chosen_channels]
+      inside = (starts >= 0) & (starts + nsamples <= min(len(row) for row in rows))
+      if (edge == 'drop'):
+          out = np.empty((np.count_nonzero(inside), len(rows), nsamples), dtype=self._dtype)
+      elif (edge == 'nan'):
+          out = np.full((len(starts), len(rows), nsamples), np.nan, dtype=self._dtype)
+      else:
+          raise Exception("Incorrect edge type specified, use 'drop' or 'nan'")
+      for k, row in enumerate(rows):
+          if np.any(inside):
+              #(windows x samples) view onto the channel; indexing it copies only the requested windows
+              windows = np.lib.stride_tricks.sliding_window_view(row, nsamples)
+              out[inside if (edge == 'nan') else slice(None), k] = windows[starts[inside]]
+          if (edge == 'nan'):
+              #windows that run past the data are copied over their overlap with the channel
+              for i in np.flatnonzero(~inside):
+                  first = max(starts[i], 0)
+                  last = min(starts[i] + nsamples, len(row))
+                  if (first < last):
+                      out[i, k, first - starts[i]:last - starts[i]] = row[first:last]
+      return out
+
+    @_instrumented('Session.event_average')
+    def event_average(self, event, lbound, rbound, channels = None, chunk_size = 1000, averager = None):
+      '''
+      Compute the event-triggered average of the data, reading chunk_size epochs at a time (see EpochAverager).
+
+      Keyword Arguments:
+      event -- label of the event the epochs are locked to (string)
+      lbound -- time before each event to include, in seconds (float)
+      rbound -- time after each event to include, in seconds (float)
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      chunk_size -- number of epochs held in memory at once (int)
+      averager -- if set, the epochs are added to this EpochAverager, e.g. to average across Sessions (EpochAverager)
+
+      Return:
+      the EpochAverager, with statistics of shape (channels x samples)
+
+      Example: avg = Session1.event_average('1', 0.1, 0.5); avg.get_mean(), avg.get_sem()
+      '''
+      if averager is None:
+          averager = EpochAverager()
+      times = self._events[event]
+      for start in range(0, len(times), chunk_size):
+          averager.update(self._epochs_at(times[start:start + chunk_size], lbound, rbound, channels))
+      return averager
+
+    def _interval_channels(self, channels, lbound, rbound):
+      '''
+      Returns the data arrays, sampling rate and sample interval of the chosen channels between lbound and rbound seconds.
+      '''
+      if channels is None:
+          channels = list(range(len(self._channels)))
+      elif isinstance(channels, (int, np.integer)):
+          channels = [channels]
+      chosen_channels = [self._channels[i] for i in channels]
+      fs = chosen_channels[0].get_fs()
+      if any(chan.get_fs() != fs for chan in chosen_channels):
+          raise Exception("All channels must have the same sampling rate.")
+      datas = [chan.get_data() for chan in chosen_channels]
+      first = max(int(lbound*fs), 0)
+      last = min(len(d) for d in datas) if rbound is None else min(int(rbound*fs), min(len(d) for d in datas))
+      if (last <= first):
+          raise Exception(f"The interval from {lbound} to {rbound} seconds contains no samples.")
+      return datas, fs, first, last
+    @_instrumented('Session.compute_psd')
+    def compute_psd(self, channels = None, lbound = 0, rbound = None, window = 'hann', nperseg = 256, noverlap = None, chunk_size = None):
+      '''
+      Compute the Power Spectral Density of the data with Welch's method, for several channels at once.
+      The interval is read chunk_size samples at a time; the result is the same as one Welch estimate over the whole interval.
+
+      Keyword Arguments:
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      lbound -- start of the interval in seconds (float)
+      rbound -- end of the interval in seconds (float). Default is the end of the data.
+      window -- window function, any window accepted by scipy.signal.get_window (string or tuple)
+      nperseg -- length of each Welch segment in samples (int)
+      noverlap -- overlap between segments in samples (int). Default is nperseg//2.
+      chunk_size -- number of samples held in memory at once (int). Default is 60 seconds of data.
+
+      Return:
+      (frequencies, psd), psd has shape (channels x frequencies) in units of amplitude**2/Hz
+      '''
+      datas, fs, first, last = self._interval_channels(channels, lbound, rbound)
+      nperseg, noverlap = _segment_parameters(last - first, nperseg, noverlap, 2)
+      chunk_size = int(60*fs) if chunk_size is None else chunk_size
+      total = 0
+      nwindows = 0
+      for start, stop, count in _window_blocks(last - first, nperseg, nperseg - noverlap, chunk_size):
+          segment = np.stack([np.asarray(d[first + start:first + stop], dtype=np.float64) for d in datas])
+          freqs, block_psd = signal.welch(segment, fs, window, nperseg, noverlap, axis=-1)
+          total = total + block_psd*count
+          nwindows = nwindows + count
+      return freqs, total/nwindows
+    @_instrumented('Session.compute_spectrogram')
+    def compute_spectrogram(self, channels = None, lbound = 0, rbound = None, window = 'hann', nperseg = 256, noverlap = None, chunk_size = None):
+      '''
+      Compute the Spectrogram of the data (short-time power spectral density), for several channels at once.
+      The interval is read chunk_size samples at a time.
+
+      Keyword Arguments:
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      lbound -- start of the interval in seconds (float)
+      rbound -- end of the interval in seconds (float). Default is the end of the data.
+      window -- window function, any window accepted by scipy.signal.get_window (string or tuple)
+      nperseg -- length of each segment in samples (int)
+      noverlap -- overlap between segments in samples (int). Default is nperseg//8, as in signal.spectrogram.
+      chunk_size -- number of samples held in memory at once (int). Default is 60 seconds of data.
+
+      Return:
+      (frequencies, times, spectrogram), spectrogram has shape (channels x frequencies x times) and times are in seconds
+      '''
+      datas, fs, first, last = self._interval_channels(channels, lbound, rbound)
+      nperseg, noverlap = _segment_parameters(last - first, nperseg, noverlap, 8)
+      chunk_size = int(60*fs) if chunk_size is None else chunk_size
+      times = []
+      blocks = []
+      for start, stop, count in _window_blocks(last - first, nperseg, nperseg - noverlap, chunk_size):
+          segment = np.stack([np.asarray(d[first + start:first + stop], dtype=np.float64) for d in datas])
+          freqs, block_times, block_sxx = signal.spectrogram(segment, fs, window, nperseg, noverlap, axis=-1)
+          times.append(block_times + (first + start)/fs)
+          blocks.append(block_sxx)
+      return freqs, np.concatenate(times), np.concatenate(blocks, axis=-1)
+    @_instrumented('Session.compute_spectrum')
+    def compute_spectrum(self, channels = None, lbound = 0, rbound = None, window = 'hann'):
+      '''
+      Compute the Magnitude Spectrum of the data, for several channels at once.
+      The magnitude is |FFT(data*window)|/sum(window) over the whole interval, as drawn by matplotlib's magnitude_spectrum.
+
+      Keyword Arguments:
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      lbound -- start of the interval in seconds (float)
+      rbound -- end of the interval in seconds (float). Default is the end of the data.
+      window -- window function, any window accepted by scipy.signal.get_window (string or tuple)
+
+      Return:
+      (frequencies, magnitude), magnitude has shape (channels x frequencies)
+      '''
+      datas, fs, first, last = self._interval_channels(channels, lbound, rbound)
+      taper = signal.get_window(window, last - first)
+      segment = np.stack([np.asarray(d[first:last], dtype=np.float64) for d in datas])*taper
+      return np.fft.rfftfreq(last - first, 1/fs), np.abs(np.fft.rfft(segment, axis=-1))/np.sum(taper)
+
+    def _epoch_batches(self, event, lbound, rbound, channels, chunk_size):
+      '''
+      Yields the windows locked to event (see epochs) as float64 arrays of shape (epochs x channels x samples),
+      with about chunk_size samples per channel in each batch.
+      '''
+      times = self._events[event]
+      fs = self._interval_channels(channels, 0, None)[1]
+      per_batch = max(chunk_size//max(int(round((lbound + rbound)*fs)), 1), 1)
+      for start in range(0, len(times), per_batch):
+          epochs = self._epochs_at(times[start:start + per_batch], lbound, rbound, channels)
+          if (len(epochs) > 0):
+              yield np.asarray(epochs, dtype=np.float64)
+
+    @_instrumented('Session.compute_csd')
+    def compute_csd(self, channels = None, lbound = 0, rbound = None, window = 'hann', nperseg = 256, noverlap = None, chunk_size = None, event = None):
+      '''
+      Compute the cross power spectral density of every pair of channels at once, with Welch's method as in signal.csd.
+      The data is read chunk_size samples at a time, so memory does not grow with the length of the recording.
+
+      Keyword Arguments:
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      lbound -- start of the interval in seconds (float), or the time before each event if event is set
+      rbound -- end of the interval in seconds (float), or the time after each event if event is set. Default is the end of the data.
+      window -- window function, any window accepted by scipy.signal.get_window (string or tuple)
+      nperseg -- length of each Welch segment in samples (int)
+      noverlap -- overlap between segments in samples (int). Default is nperseg//2.
+      chunk_size -- number of samples per channel held in memory at once (int). Default is 60 seconds of data.
+      event -- if set, the segments are taken from the windows locked to this event label instead of one interval (string)
+
+      Return:
+      (frequencies, csd), csd has shape (channels x channels x frequencies), csd[i, j] is signal.csd of channels i and j (conjugate of channel i times channel j)
+      '''
+      if (event is not None and rbound is None):
+          raise Exception("rbound must be set when event is set")
+      datas, fs, first, last = self._interval_channels(channels, lbound if event is None else 0, rbound if event is None else None)
+      nsamples = (last - first) if event is None else int(round((lbound + rbound)*fs))
+      nperseg, noverlap = _segment_parameters(nsamples, nperseg, noverlap, 2)
+      chunk_size = int(60*fs) if chunk_size is None else chunk_size
+      taper = signal.get_window(window, nperseg)
+      total = 0
+      nsegments = 0
+      if event is None:
+          for start, stop, count in _window_blocks(nsamples, nperseg, nperseg - noverlap, chunk_size):
+              block = np.stack([np.asarray(d[first + start:first + stop], dtype=np.float64) for d in datas])
+              block_csd, block_count = _cross_spectra(block, taper, nperseg - noverlap)
+              total = total + block_csd
+              nsegments = nsegments + block_count
+      else:
+          for epochs in self._epoch_batches(event, lbound, rbound, channels, chunk_size):
+              block_csd, block_count = _cross_spectra(epochs, taper, nperseg - noverlap)
+              total = total + block_csd
+              nsegments = nsegments + block_count
+      if (nsegments == 0):
+          raise Exception("No complete segments in the data.")
+      #density scaling of the one-sided spectrum, as in signal.csd
+      csd = total/nsegments/(fs*np.sum(taper**2))
+      csd[..., 1:nperseg - nperseg//2] *= 2
+      return np.fft.rfftfreq(nperseg, 1/fs), csd
+    @_instrumented('Session.compute_coherence')
+    def compute_coherence(self, channels = None, lbound = 0, rbound = None, window = 'hann', nperseg = 256, noverlap = None, chunk_size = None, event = None):
+      '''
+      Compute the magnitude-squared coherence |Pxy|**2/(Pxx*Pyy) of every pair of channels at once, as in signal.coherence,
+      over one interval or over the windows locked to an event. Arguments are the same as for compute_csd.
+
+      Return:
+      (frequencies, coherence), coherence has shape (channels x channels x frequencies) with values from 0 to 1
+
+      Example: freqs, coh = Session1.compute_coherence(nperseg=1024); coh[0, 1] is the coherence of channels 0 and 1
+      '''
+      freqs, csd = self.compute_csd(channels, lbound, rbound, window, nperseg, noverlap, chunk_size, event)
+      power = np.real(np.einsum('iif->if', csd))
+      with np.errstate(invalid='ignore', divide='ignore'):
+          return freqs, np.abs(csd)**2/(power[:, np.newaxis, :]*power[np.newaxis, :, :])
+
+    @_instrumented('Session.compute_xcorr')
+    def compute_xcorr(self, channels = None, lbound = 0, rbound = None, max_lag = 0.05, normalize = True, chunk_size = None, event = None):
+      '''
+      Compute the cross-correlation of every pair of channels at once, for lags from -max_lag to max_lag, with FFTs.
+      The interval is read in blocks of chunk_size samples (plus max_lag of context on both sides); the cross spectra of the blocks
+      are summed and transformed back once, so the result is the exact correlation over the whole interval with bounded memory.
+      The mean of each channel over the interval (or of each epoch, if event is set) is removed first.
+
+      Keyword Arguments:
+      channels -- channel index or list of channel indices (int or list: int). Default is all channels.
+      lbound -- start of the interval in seconds (float), or the time before each event if event is set
+      rbound -- end of the interval in seconds (float), or the time after each event if event is set. Default is the end of the data.
+      max_lag -- largest lag in seconds (float)
+      normalize -- if True, the correlation is divided by the square root of the energies of the two channels, giving values from -1 to 1 (Boolean)
+      chunk_size -- number of samples per block (int). Memory use is about channels**2 x chunk_size x 8 bytes. Default is 8 times max_lag, at least 4096 samples.
+      event -- if set, the correlation is summed over the windows locked to this event label instead of one interval (string)
+
+      Return:
+      (lags, xcorr), lags in seconds and xcorr of shape (channels x channels x lags); xcorr[i, j, k] is the sum over t of
+      x_i(t + lags[k])*x_j(t), so a peak at a positive lag means channel i lags channel j
+      '''
+      if (event is not None and rbound is None):
+          raise Exception("rbound must be set when event is set")
+      datas, fs, first, last = self._interval_channels(channels, lbound if event is None else 0, rbound if event is None else None)
+      max_lag_samples = int(round(max_lag*fs))
+      if event is None:
+          block_size = max(8*max_lag_samples, 4096) if chunk_size is None else chunk_size
+          means = np.array([np.mean(d[first:last], dtype=np.float64) for d in datas])[:, np.newaxis]
+          def blocks():
+              for start in range(first, last, block_size):
+                  stop = min(start + block_size, last)
+                  #the block of channel j, and the block of channel i with max_lag_samples of context (zero outside the interval)
+                  context_start = max(start - max_lag_samples, first)
+                  context_stop = min(stop + max_lag_samples, last)
+                  extended = np.zeros((len(datas), stop - start + 2*max_lag_samples))
+                  offset = context_start - (start - max_lag_samples)
+                  extended[:, offset:offset + context_stop - context_start] = np.stack([np.asarray(d[context_start:context_stop], dtype=np.float64) for d in datas]) - means
+                  yield extended[np.newaxis], extended[np.newaxis, :, max_lag_samples:max_lag_samples + stop - start]
+      else:
+          block_size = int(round((lbound + rbound)*fs))
+          def blocks():
+              for epochs in self._epoch_batches(event, lbound, rbound, channels, 4096 if chunk_size is None else chunk_size):
+                  epochs = epochs - np.mean(epochs, axis=-1, keepdims=True)
+                  yield np.pad(epochs, ((0, 0), (0, 0), (max_lag_samples, max_lag_samples))), epochs
+      #no circular wrap-around for lags up to 2*max_lag_samples between a block and its extended counterpart
+      nfft = fft.next_fast_len(block_size + 2*max_lag_samples, real=True)
+      total = 0
+      energy = 0
+      for extended, block in blocks():
+          total = total + np.einsum('eif,ejf->ijf', fft.rfft(extended, nfft, axis=-1), fft.rfft(block, nfft, axis=-1).conj())
+          energy = energy + np.sum(block**2, axis=(0, -1))
+      xcorr = fft.irfft(total, nfft, axis=-1)[..., :2*max_lag_samples + 1]
+      if normalize:
+          with np.errstate(invalid='ignore', divide='ignore'):
+              xcorr = xcorr/np.sqrt(energy[:, np.newaxis, np.newaxis]*energy[np.newaxis, :, np.newaxis])
+      return np.arange(-max_lag_samples, max_lag_samples + 1)/fs, xcorr
+
+    @_instrumented('Session.compute_lags')
+    def compute_lags(self, channels = None, lbound = 0, rbound = None, max_lag = 0.05, chunk_size = None, event = None):
+      '''
+      Estimate the time lag between every pair of channels from the peak of their normalized cross-correlation (see compute_xcorr).
+      The peak of |xcorr| is refined to a fraction of a sample with a parabola through its neighbours.
+
+      Return:
+      (lags, peaks), both of shape (channels x channels): lags[i, j] in seconds is positive if channel i lags channel j,
+      and peaks[i, j] is the correlation at the peak (negative for inverted signals)
+
+      Example: lags, peaks = Session1.compute_lags(max_lag=0.01)
+      '''
+      fs = self._interval_channels(channels, 0, None)[1]
+      lag_axis, xcorr = self.compute_xcorr(channels, lbound, rbound, max_lag, True, chunk_size, event)
+      magnitude = np.abs(xcorr)
+      peak = np.argmax(magnitude, axis=-1)
+      peaks = np.take_along_axis(xcorr, peak[..., np.newaxis], axis=-1)[..., 0]
+      if (len(lag_axis) < 3):
+          return lag_axis[peak], peaks
+      #parabolic interpolation where the peak has a neighbour on both sides
+      inner = np.clip(peak, 1, len(lag_axis) - 2)
+      below, at, above = (np.take_along_axis(magnitude, (inner + step)[..., np.newaxis], axis=-1)[..., 0] for step in (-1, 0, 1))
+      curvature = below - 2*at + above
+      with np.errstate(invalid='ignore', divide='ignore'):
+          shift = np.where((peak == inner) & (curvature < 0), 0.5*(below - above)/curvature, 0.0)
+      return lag_axis[peak] + shift/fs, peaks
+
     # plotting functions      
-    def plot_interval(self, channelindex, left_bound, right_bound, offset=0, events = False, event_marker_factor=2, show = True, make_fig = True, legends=False):
+    def _render_interval(self, channel, left_bound, right_bound, minmax = True):
+      '''
+      Returns the time and amplitude arrays used to plot an interval of a channel.
+
+      Keyword Arguments:
+      channel -- the Channel to plot (Channel)
+      left_bound -- start of the interval in seconds (float)
+      right_bound -- end of the interval in seconds (float)
+      minmax -- if True, the interval is reduced to a min/max envelope with one bin per pixel of the figure width (Boolean)
+                Long intervals are read from the channel's OverviewPyramid (see Channel.get_pyramid).
+      '''
+      fs = channel.get_fs()
+      data = channel.get_data()
+      first = max(int(left_bound*fs), 0)
+      last = min(int(right_bound*fs), len(data))
+      npixels = _figure_width_pixels()
+      #intervals with many samples per pixel are read from the channel's overview pyramid instead of the samples
+      use_pyramid = minmax and ((last - first)/npixels >= 2**PYRAMID_BASE_LEVEL)
+      pyramid_envelope = channel.get_pyramid().envelope(first, last, npixels) if use_pyramid else None
+      if pyramid_envelope is not None:
+          centers, mins, maxs = pyramid_envelope
+          time_axis = np.repeat(centers/fs, 2)
+          data_axis = np.column_stack((mins, maxs)).ravel()
+      elif minmax:
+          time_axis, data_axis = _minmax_envelope(data, first, last, fs, npixels)
+      else:
+          time_axis, data_axis = channel.get_time()[first:last], data[first:last]
+      #float copy of the plotted samples, so offsets cannot overflow integer WAV data
+      return time_axis, np.asarray(data_axis, dtype=np.float64)
+    @_instrumented('Session.plot_interval')
+    def plot_interval(self, channelindex, left_bound, right_bound, offset=0, events = False, event_marker_factor=2, show = True, make_fig = True, legends=False, minmax = True):
       '''
       Plot an interval of the data.
 
@@ -531,6 +2367,8 @@ class Session:
       show -- if True, shows plot (Boolean). Default value is True.
       make_fig -- if True, makes a new Figure object (Boolean). Default value is True.
       legends -- if True, shows legend of plots on figure (Boolean). Default value is False
+      minmax -- if True, each channel is drawn as a min/max envelope with one bin per pixel of the figure width,
+                so the drawing cost does not grow with the length of the interval (Boolean). Default value is True.
 
       '''
       if make_fig:
@@ -543,14 +2381,8 @@ class Session:
             offset_index = 0
             for chanind in channelindex:
                 chosen_channel = self._channels[chanind]
-                chosen_channel_fs = chosen_channel.get_fs()
-                left_boundsamp = left_bound*chosen_channel_fs
-                right_boundsamp = right_bound*chosen_channel_fs
-                full_time_axis = chosen_channel.get_time()
-                time_axis = full_time_axis[left_boundsamp: right_boundsamp]
-                full_data_axis = chosen_channel.get_data()
-                data_axis = full_data_axis[left_boundsamp: right_boundsamp]
-                data_axis = list(np.asarray(data_axis) + (offset*offset_index))
+                time_axis, data_axis = self._render_interval(chosen_channel, left_bound, right_bound, minmax)
+                data_axis = data_axis + (offset*offset_index)
                 print(len(data_axis))
                 if np.min(data_axis) < min_data:
                     min_data = np.min(data_axis)
@@ -563,14 +2395,8 @@ class Session:
                 offset_index = offset_index + 1
       else:       
             chosen_channel = self._channels[channelindex]
-            chosen_channel_fs = chosen_channel.get_fs()
-            left_bound = left_bound*chosen_channel_fs
-            right_bound = right_bound*chosen_channel_fs
-            full_time_axis = chosen_channel.get_time()
-            time_axis = full_time_axis[left_bound: right_bound]
-            full_data_axis = chosen_channel.get_data()
-            data_axis = full_data_axis[left_bound: right_bound]
-            data_axis = list(np.asarray(data_axis) + offset)
+            time_axis, data_axis = self._render_interval(chosen_channel, left_bound, right_bound, minmax)
+            data_axis = data_axis + offset
             min_data = np.min(data_axis)
             max_data = np.max(data_axis)
             plt.ylim(min_data*1.1, max_data*1.1)
@@ -588,14 +2414,9 @@ class Session:
             event_plots = []
             for event in self._events:
                 color = 'C' + str(color_index)
-                time_markers = self._events[event]
-                time_markers_interval = []
+                time_markers_interval = self.get_events_interval(left_bound, right_bound, event)
                 event_label = f"Event {event}"
                 event_labels.append(event_label)
-                for marker in time_markers: 
-                    marker_samp = marker*chosen_channel_fs
-                    if (left_bound <= marker_samp) and (right_bound >= marker_samp):
-                        time_markers_interval.append(marker)
                 markerlength = 10*(max_data - min_data)
                 event_plot = plt.eventplot(time_markers_interval, lineoffsets=offset, linelengths= markerlength, linewidths = 1, colors = color, label ='Event')
                 print("Event plotted")
@@ -608,63 +2429,62 @@ class Session:
     
             
         
-    def plot_overview(self, offset=0, show_events=False, show_legends=False):
+    @_instrumented('Session.plot_overview')
+    def plot_overview(self, offset=0, show_events=False, show_legends=False, minmax = True):
         plt.figure()
         if (self._nchannels == 1):
             left_bnd = 0
-            right_bnd = len(self._channeldata)
-            self.plot_interval(0, left_bnd, right_bnd, events = show_events, show=False, make_fig=False, legends=show_legends)
+            right_bnd = len(self.get_channel(0).get_data())/self.get_channel(0).get_fs()
+            self.plot_interval(0, left_bnd, right_bnd, events = show_events, show=False, make_fig=False, legends=show_legends, minmax = minmax)
             
         elif (self._nchannels > 1):
             left_bnd = 0
-            right_bnd = len(self.get_channel(0).get_data())
+            right_bnd = len(self.get_channel(0).get_data())/self.get_channel(0).get_fs()
             chanindices = [i for i in range(self._nchannels)]
-            self.plot_interval(chanindices, left_bnd, right_bnd, offset = offset, events = show_events, show = False, make_fig=False, legends=show_legends)
+            self.plot_interval(chanindices, left_bnd, right_bnd, offset = offset, events = show_events, show = False, make_fig=False, legends=show_legends, minmax = minmax)
         plt.xlabel("Time(sec)")
         plt.ylabel("Amplitude")
         plt.show()
 
+    @_instrumented('Session.pileplot')
     def pileplot(self, spec_event, lbound, rbound, spec_channel = 0, spec_color = 'k', alpha = 0.2):
         plt.figure()
-        timemarkers = self._events[spec_event]
-        spec_channel_data = self.get_channel(spec_channel).get_data()
-        time_axis = np.arange(0, lbound + rbound, (1/self._samplerate))
-        for timemarker in timemarkers:
-            data_axis = spec_channel_data[math.floor((timemarker - lbound)*self._samplerate): math.floor((timemarker + rbound)*self._samplerate)]
-            plt.plot(time_axis, data_axis, color = spec_color, alpha = alpha)
+        traces = self.epochs(spec_event, lbound, rbound, spec_channel)[:, 0, :]
+        time_axis = np.arange(traces.shape[-1])/self.get_channel(spec_channel).get_fs()
+        plt.plot(time_axis, traces.T, color = spec_color, alpha = alpha)
         plt.xlabel("Time(sec)")
         plt.ylabel("Amplitude")
         plt.show()
     
-    def tlavgplot(self, spec_event, lbound, rbound, spec_channel = 0, spec_color = 'k', showtraces = False, alpha = 0.2):
+    @_instrumented('Session.tlavgplot')
+    def tlavgplot(self, spec_event, lbound, rbound, spec_channel = 0, spec_color = 'k', showtraces = False, alpha = 0.2, showsem = False):
         plt.figure()
-        timemarkers = self._events[spec_event]
-        spec_channel_data = self.get_channel(spec_channel).get_data()
-        time_axis = np.arange(0, lbound + rbound, (1/self._samplerate))
-        avg_data = []
-        for timemarker in timemarkers:
-            data_axis = spec_channel_data[math.floor((timemarker - lbound)*self._samplerate): math.floor((timemarker + rbound)*self._samplerate)]
-            if showtraces:
-                plt.plot(time_axis, data_axis, color = spec_color, alpha = alpha)
-            avg_data.append(data_axis)
-        avg_trace = np.mean(avg_data, axis = 0)
+        averager = self.event_average(spec_event, lbound, rbound, spec_channel)
+        avg_trace = averager.get_mean()[0]
+        time_axis = np.arange(len(avg_trace))/self.get_channel(spec_channel).get_fs()
+        if showtraces:
+            traces = self.epochs(spec_event, lbound, rbound, spec_channel)[:, 0, :]
+            plt.plot(time_axis, traces.T, color = spec_color, alpha = alpha)
+        if showsem:
+            sem_trace = averager.get_sem()[0]
+            plt.fill_between(time_axis, avg_trace - sem_trace, avg_trace + sem_trace, color = 'r', alpha = alpha)
         plt.plot(time_axis, avg_trace, color = 'r')
         plt.xlabel("Time(sec)")
         plt.ylabel("Amplitude")
         plt.show()
         return
     
+    @_instrumented('Session.joydivplot')
     def joydivplot(self, spec_event, lbound, rbound, spec_channel = 0, spec_color = 'k', alpha = 0.2):
         fig = plt.figure()
-        timemarkers = self._events[spec_event]
+        traces = self.epochs(spec_event, lbound, rbound, spec_channel)[:, 0, :]
         spec_channel_data = self.get_channel(spec_channel).get_data()
-        time_axis = np.arange(0, lbound + rbound, (1/self._samplerate))
+        time_axis = np.arange(traces.shape[-1])/self.get_channel(spec_channel).get_fs()
         plot_index = 1
         ylim_top =  np.max(spec_channel_data)
         ylim_bottom = np.min(spec_channel_data)
-        for timemarker in timemarkers:
-            data_axis = spec_channel_data[math.floor((timemarker - lbound)*self._samplerate): math.floor((timemarker + rbound)*self._samplerate)]
-            plt.subplot(len(timemarkers),1,plot_index)
+        for data_axis in traces:
+            plt.subplot(len(traces),1,plot_index)
             plt.plot(time_axis, data_axis, color = spec_color, alpha = alpha)
             plt.ylabel("Amplitude")
             #plt.autoscale(False)
@@ -674,7 +2494,7 @@ class Session:
             ax.spines['right'].set_visible(False)
             ax.spines['bottom'].set_visible(False)
             ax.set_ylim(ylim_bottom, ylim_top)
-            if plot_index == len(timemarkers):
+            if plot_index == len(traces):
                 ax.axes.xaxis.set_visible(True)
                 ax.spines['bottom'].set_visible(True)
             plot_index = plot_index + 1
@@ -684,32 +2504,21 @@ class Session:
         return
 
 
+    @_instrumented('Session.rasterplot')
     def rasterplot(self, spec_channel, lbound = 0, rbound = None):
         chosen_channel = self._channels[spec_channel]
         chosen_channel_fs = chosen_channel.get_fs()
-        lbound = lbound*chosen_channel_fs
         if rbound == None:
-            rbound = len(self.get_channel(spec_channel).get_data()) - 1
-        rbound = rbound*chosen_channel_fs
-        full_time_axis = chosen_channel.get_time()
-        time_axis = full_time_axis[lbound: rbound]
-        full_data_axis = chosen_channel.get_data()
-        data_axis = full_data_axis[lbound: rbound]
-        #data_axis = list(np.asarray(data_axis))
+            rbound = (len(chosen_channel.get_data()) - 1)/chosen_channel_fs
         color_index = 0
         #n_colors = len(self._events)
         event_plots = []
         event_labels = []
         for event in self._events:
             color = 'C' + str(color_index)
-            time_markers = self._events[event]
-            time_markers_interval = []
+            time_markers_interval = self.get_events_interval(lbound, rbound, event)
             event_label = f"Event {event}"
             event_labels.append(event_label)
-            for marker in time_markers: 
-                marker_samp = marker*chosen_channel_fs
-                if (lbound <= marker_samp) and (rbound >= marker_samp):
-                    time_markers_interval.append(marker)
             event_plot = plt.eventplot(time_markers_interval, linewidths = 1, colors = color, label ='Event')
             event_plots.append(event_plot)
             color_index = color_index + 1
@@ -718,6 +2527,7 @@ class Session:
         plt.legend(event_labels)
         plt.show()
 
+    @_instrumented('Session.mag_spectrum')
     def mag_spectrum(self, spec_channel, lbound = 0, rbound = None):
         '''
         Plot the Magnitude Spectrum of the data.
@@ -728,22 +2538,14 @@ class Session:
         rbound -- calculate the Magnitude Spectrum for data upto rbound (float) 
         '''
         plt.figure()
-        chosen_channel = self._channels[spec_channel]
-        chosen_channel_fs = chosen_channel.get_fs()
-        lbound = lbound*chosen_channel_fs
-        if rbound == None:
-            rbound = len(self.get_channel(spec_channel).get_data()) - 1
-        rbound = rbound*chosen_channel_fs
-        full_time_axis = chosen_channel.get_time()
-        time_axis = full_time_axis[lbound: rbound]
-        full_data_axis = chosen_channel.get_data()
-        data_axis = full_data_axis[lbound: rbound]
-        plt.magnitude_spectrum(data_axis, Fs = chosen_channel_fs)
+        freqs, magnitude = self.compute_spectrum(spec_channel, lbound, rbound)
+        plt.plot(freqs, magnitude[0])
         plt.title("Magnitude Spectrum of the Signal")
-        plt.xlabel("Time(sec)")
+        plt.xlabel("Frequency(Hz)")
         plt.ylabel("Amplitude of Spectrum")
         plt.show()
 
+    @_instrumented('Session.spectrogram')
     def spectrogram(self, spec_channel, lbound = 0, rbound = None):
         '''
         Plot the Spectrogram of the data.
@@ -754,22 +2556,14 @@ class Session:
         rbound -- calculate spectrogram for data upto rbound (float) 
         '''
         plt.figure()
-        chosen_channel = self._channels[spec_channel]
-        chosen_channel_fs = chosen_channel.get_fs()
-        lbound = lbound*chosen_channel_fs
-        if rbound == None:
-            rbound = len(self.get_channel(spec_channel).get_data()) - 1
-        rbound = rbound*chosen_channel_fs
-        full_time_axis = chosen_channel.get_time()
-        time_axis = full_time_axis[lbound: rbound]
-        full_data_axis = chosen_channel.get_data()
-        data_axis = full_data_axis[lbound: rbound]
-        plt.specgram(data_axis, Fs = chosen_channel_fs)
+        freqs, times, sxx = self.compute_spectrogram(spec_channel, lbound, rbound)
+        plt.pcolormesh(times, freqs, 10*np.log10(sxx[0] + np.finfo(float).tiny), shading = 'auto')
         plt.title("Spectrogram of the Signal")
         plt.xlabel("Time(sec)")
-        plt.ylabel("Amplitude")
+        plt.ylabel("Frequency(Hz)")
         plt.show()
 
+    @_instrumented('Session.psd')
     def psd(self, spec_channel, lbound = 0, rbound = None):
         '''
         Plot the Power Spectral Density of the data.
@@ -780,52 +2574,334 @@ class Session:
         rbound -- calculate psd for data upto rbound (float) 
         '''
         plt.figure()
-        chosen_channel = self._channels[spec_channel]
-        chosen_channel_fs = chosen_channel.get_fs()
-        lbound = lbound*chosen_channel_fs
-        if rbound == None:
-            rbound = len(self.get_channel(spec_channel).get_data()) - 1
-        rbound = rbound*chosen_channel_fs
-        full_time_axis = chosen_channel.get_time()
-        time_axis = full_time_axis[lbound: rbound]
-        full_data_axis = chosen_channel.get_data()
-        data_axis = full_data_axis[lbound: rbound]
-        plt.psd(data_axis, Fs = chosen_channel_fs)
+        freqs, psd = self.compute_psd(spec_channel, lbound, rbound)
+        plt.plot(freqs, 10*np.log10(psd[0] + np.finfo(float).tiny))
+        plt.grid(True)
         plt.title("Power Spectral Density Plot of the Signal")
         plt.xlabel("Frequency(Hz)")
         plt.ylabel("Amplitude (dB/Hz")
         plt.show()
 
-help(Session)
+"""Real-Time Acquisition"""
 
-"""Importing Session and Plotting Overview"""
+#fixed-size circular buffer holding the most recent samples of a stream
+class RingBuffer:
+    def __init__(self, capacity, dtype = np.float64):
+        self._buffer = np.zeros(capacity, dtype = dtype) #sample storage, written circularly
+        self._count = 0 #total number of samples ever written
 
-s1 = Session("/content/BYB_Recording_2021-06-18_16.14.32.wav", 'y')
+    def __len__(self):
+        return min(self._count, len(self._buffer))
 
-s1.plot_overview(show_events=True,show_legends=True)
-
-"""Normalizing"""
+    def get_count(self):
+        '''
+        Returns the total number of samples written to the buffer, including samples that have been overwritten.
+        '''
+        return self._count
 
-s1._normalize("scalar", 1/np.max(s1.get_channel(1).get_data()), 1)
-#s1.plot_interval(1,1,10)
-s1._normalize("scalar", 1/np.max(s1.get_channel(0).get_data()), 0)
+    def write(self, block):
+        '''
+        Append a block of samples, overwriting the oldest samples once the buffer is full.
+        '''
+        capacity = len(self._buffer)
+        nwritten = len(block)
+        block = block[-capacity:]
+        position = (self._count + nwritten - len(block)) % capacity
+        first_part = min(len(block), capacity - position)
+        self._buffer[position:position + first_part] = block[:first_part]
+        self._buffer[:len(block) - first_part] = block[first_part:]
+        self._count = self._count + nwritten
 
-s1.plot_overview(offset=5, show_events=True,show_legends=True)
+    def get_data(self):
+        '''
+        Returns a copy of the buffered samples in the order they were written.
+        '''
+        if (self._count <= len(self._buffer)):
+            return self._buffer[:self._count].copy()
+        position = self._count % len(self._buffer)
+        return np.concatenate((self._buffer[position:], self._buffer[:position]))
+
+#Channel fed block by block from a live stream, keeping the most recent capacity seconds in a RingBuffer
+#filt adds causal filter stages whose state (zi) is carried from block to block, and ingest detects spikes
+#incrementally, so each block costs time proportional to its own length rather than to the recording
+#times (get_time, spike times, intervals of get_std and get_interval_stats) are stream times, counted from the first ingested sample
+class OnlineChannel(Channel):
+    def __init__(self, fs, capacity = 10, label = None, color = None, latency_budget = None, dtype = None):
+        self._ring = RingBuffer(int(round(capacity*fs)), np.dtype(dtype if dtype is not None else np.float64)) #most recent samples, after filtering
+        self._stream_offset = 0 #stream index of the sample counted first by the ring buffer (nonzero once the data has been replaced)
+        self._stages = [] #(cutoff, ftype, filter_order) of the online filter stages
+        self._sos = None #cascaded second-order sections of the online filter stages
+        self._zi = None #filter state carried between blocks
+        self._spike_level = None #signed spike threshold in data units; None disables spike detection
+        self._refractory_samples = 0 #minimum samples between spike crossings
+        self._last_above = False #whether the last sample of the previous block was beyond the threshold
+        self._last_spike = None #sample index of the last detected spike, for the refractory period
+        self._spikes = [] #sample indices of the spikes detected in the buffered samples
+        self._latency_budget = latency_budget #maximum time in seconds to process one block; None disables the check
+        self._latency = 0.0 #time taken to process the last block, in seconds
+        self._overruns = 0 #number of blocks that took longer than the latency budget
+        Channel.__init__(self, fs = fs, label = label, color = color, dtype = dtype)
+
+    #the channel data is the content of the ring buffer; setting it (e.g. by normalize or set_data) restarts the buffer
+    #with the given samples, the newest of which keeps the place of the newest sample in the stream, so stream times,
+    #spike indices and later blocks passed to ingest carry on from the same sample count
+    @property
+    def _data(self):
+        return self._ring.get_data()
+    @_data.setter
+    def _data(self, data_in):
+        count = self._stream_count()
+        self._ring = RingBuffer(len(self._ring._buffer), self._dtype)
+        self._ring.write(np.asarray(data_in, dtype = self._dtype))
+        self._stream_offset = max(count, len(self._ring)) - self._ring.get_count()
+
+    #number of samples in the stream so far, and stream index of the oldest sample in the buffer
+    def _stream_count(self):
+        return self._ring.get_count() + self._stream_offset
+    def _first_sample(self):
+        return self._stream_count() - len(self._ring)
 
-"""Filtering"""
+    def get_time(self):
+        return TimeAxis(len(self._ring), self._fs, self._first_sample())
+    def get_latency(self):
+        '''
+        Returns the time in seconds taken to process the last block.
+        '''
+        return self._latency
+    def get_overruns(self):
+        '''
+        Returns the number of blocks that took longer than the latency budget to process.
+        '''
+        return self._overruns
+    def get_spike_times(self):
+        '''
+        Returns the times in seconds of the spikes detected in the samples still held in the buffer.
+        '''
+        spikes = np.asarray(self._spikes, dtype = np.int64)
+        return spikes[spikes >= self._first_sample()]/self._fs
+
+    #the Channel methods below work on the buffered samples; their times are converted to and from stream times
+    def _interval_samples(self, lbound, rbound):
+        start = self._first_sample()/self._fs
+        return Channel._interval_samples(self, np.asarray(lbound) - start, np.asarray(rbound) - start)
+    def detect_spikes(self, threshold = 5, noise = 'mad', direction = 'neg', refractory = 0.001, snippet = (0.0005, 0.001), chunk_size = None):
+        times, snippets = Channel.detect_spikes(self, threshold, noise, direction, refractory, snippet, chunk_size)
+        return times + self._first_sample()/self._fs, snippets
+    def rolling_stats(self, window, step = None, stats = ('mean', 'std', 'rms', 'peak')):
+        times, result = Channel.rolling_stats(self, window, step, stats)
+        return times + self._first_sample()/self._fs, result
+
+    #the stream keeps arriving at fs, so the buffer cannot be resampled (decim resamples too)
+    def resample(self, fs_out, chunk_size = None, out = None):
+        raise Exception("An OnlineChannel cannot be resampled; resample a Channel of its get_data() instead.")
 
-#s1._filt(cutoff=50, ftype = 'lp', filter_order = 2, channel_index = 0)
-s1._filt(cutoff=30, ftype = 'lp', filter_order = 2, channel_index = 0)
-s1.plot_overview(offset=5)
+    def filt(self, cutoff, ftype, filter_order = 2):
+        '''
+        Add a causal filter stage applied to every block passed to ingest.
+        Filtering is single-pass (zero-phase filtering needs future samples), so online filters add phase delay.
 
-'''Plotting Interval'''
+        Keyword Arguments:
+        cutoff -- cutoff frequency (int or float), or a 2-element list for 'bp' and 'br'
+        ftype -- 'hp', 'lp', 'n', 'bp' or 'br' (string)
+        filter_order -- filter order (int)
+        '''
+        stages = self._stages + [(cutoff, ftype, filter_order)]
+        self._sos = self._design_stages(stages)
+        self._stages = stages
+        self._zi = None
+        self._record_stages([(cutoff, ftype, filter_order)])
+        return self
 
-s1.plot_interval(0,1,10)
+    def set_spike_detection(self, threshold, direction = 'neg', refractory = 0.001, noise = None):
+        '''
+        Enable incremental spike detection on the filtered blocks passed to ingest.
 
-"""Power Spectral Density"""
+        Keyword Arguments:
+        threshold -- spike threshold in data units, or as a multiple of the noise level if noise is set (float)
+        direction -- 'neg' or 'pos' (string)
+        refractory -- minimum time between spikes in seconds (float)
+        noise -- if 'mad' or 'std', the noise level is estimated from the samples currently in the buffer (string)
+        '''
+        if (noise == 'mad'):
+            threshold = threshold*np.median(np.abs(self._ring.get_data()))/0.6745
+        elif (noise == 'std'):
+            threshold = threshold*np.std(self._ring.get_data())
+        elif noise is not None:
+            raise Exception("Incorrect noise estimate specified, use 'mad' or 'std'")
+        if (direction == 'neg'):
+            self._spike_level = -abs(threshold)
+        elif (direction == 'pos'):
+            self._spike_level = abs(threshold)
+        else:
+            raise Exception("Incorrect spike direction specified, use 'neg' or 'pos'")
+        self._refractory_samples = int(round(refractory*self._fs))
+        return self
 
-s1.psd(0,)
+    def ingest(self, block):
+        '''
+        Filter a block of new samples, append it to the buffer and detect the spikes it contains.
 
-"""Spectrogram of Signal"""
+        Keyword Arguments:
+        block -- the newest samples from the stream (array)
 
-s1.spectrogram(0, 0, 10)
\ No newline at end of file
+        Return:
+        times in seconds of the spikes detected in the block
+        '''
+        start_time = time.perf_counter()
+        #the filter and its state are float64 (see _sosfiltfilt_chunked); the ring buffer stores the compute precision
+        block = np.asarray(block, dtype = np.float64)
+        if (self._sos is not None) and (len(block) > 0):
+            if self._zi is None:
+                self._zi = signal.sosfilt_zi(self._sos)*block[0]
+            block, self._zi = signal.sosfilt(self._sos, block, zi = self._zi)
+        first_sample = self._stream_count()
+        self._ring.write(block)
+        spikes = self._detect_block(block, first_sample)
+        oldest = self._first_sample()
+        self._spikes = [spike for spike in self._spikes if spike >= oldest] + list(spikes)
+        self._invalidate()
+
+        self._latency = time.perf_counter() - start_time
+        if (self._latency_budget is not None) and (self._latency > self._latency_budget):
+            self._overruns = self._overruns + 1
+        return spikes/self._fs
+
+    #threshold crossings of one block, continuing the crossing state and refractory period of the previous block
+    def _detect_block(self, block, first_sample):
+        if (self._spike_level is None) or (len(block) == 0):
+            return np.zeros(0, dtype = np.int64)
+        above = (block < self._spike_level) if (self._spike_level < 0) else (block > self._spike_level)
+        crossings = np.flatnonzero(above & ~np.concatenate(([self._last_above], above[:-1]))) + first_sample
+        self._last_above = bool(above[-1])
+        if (len(crossings) == 0):
+            return crossings
+        last_spike = self._last_spike if self._last_spike is not None else -self._refractory_samples - 1
+        spikes, last_spike = _refractory_filter(crossings, self._refractory_samples, last_spike)
+        if (len(spikes) > 0):
+            self._last_spike = last_spike
+        return spikes
+
+#simulated SpikerBox stream for feeding an OnlineChannel without hardware
+#yields nblocks blocks (forever if None) of block_size samples: gaussian noise, 60 Hz hum and spikes at spike_rate per second
+def simulated_source(fs, block_size, nblocks = None, noise = 1.0, hum = 0.5, spike_rate = 20, spike_amplitude = -10, seed = None):
+    rng = np.random.default_rng(seed)
+    waveform = spike_amplitude*np.exp(-((np.arange(int(0.002*fs)) - 0.0005*fs)/(0.0002*fs))**2)
+    carry = np.zeros(len(waveform)) #tail of spikes that started near the end of the previous block
+    first_sample = 0
+    nyielded = 0
+    while (nblocks is None) or (nyielded < nblocks):
+        block = np.zeros(block_size + len(waveform))
+        block[:len(carry)] = carry
+        for onset in np.flatnonzero(rng.random(block_size) < spike_rate/fs):
+            block[onset:onset + len(waveform)] += waveform
+        carry = block[block_size:].copy()
+        block = block[:block_size]
+        block += noise*rng.standard_normal(block_size) + hum*np.sin(2*np.pi*60*(first_sample + np.arange(block_size))/fs)
+        first_sample = first_sample + block_size
+        nyielded = nyielded + 1
+        yield block
+
+"""Synthetic Recordings"""
+
+def synthetic_recording(datapath, duration = 60, nchannels = 2, fs = 10000, noise = 1.0, hum = 0.5, spike_rate = 20, spike_amplitude = -10,
+                        event_rate = 1, event_labels = ('1', '2'), scale = 500, seed = None, chunk_size = 2**20):
+    '''
+    Write a synthetic BYB recording: a 16-bit WAV file and its "-events.txt" sidecar, for benchmarks and examples.
+    Each channel is an independent simulated_source stream (gaussian noise, 60 Hz hum and spikes), and events are
+    a Poisson process whose labels are drawn at random from event_labels. The WAV file is written chunk_size samples
+    at a time, so recordings of several hours can be generated without holding them in memory.
+
+    Keyword Arguments:
+    datapath -- path of the WAV file to write (string)
+    duration -- length of the recording in seconds (float)
+    nchannels -- number of channels (int)
+    fs -- sampling rate in Hz (int)
+    noise, hum, spike_rate, spike_amplitude -- signal model of each channel, see simulated_source (float)
+    event_rate -- mean number of events per second (float)
+    event_labels -- labels the events are drawn from (list: string)
+    scale -- number of WAV integer steps per signal unit (float)
+    seed -- seed of the random number generator; the same seed writes the same recording (int)
+    chunk_size -- number of samples generated and written at a time (int)
+
+    Return:
+    (datapath, eventspath)
+
+    Example: synthetic_recording("BYB_Recording_synthetic.wav", duration=3600, nchannels=4)
+    '''
+    rng = np.random.default_rng(seed)
+    nsamples = int(round(duration*fs))
+    nblocks = -(-nsamples//chunk_size)
+    sources = [simulated_source(fs, chunk_size, nblocks, noise, hum, spike_rate, spike_amplitude, seed = rng.integers(2**32))
+               for i in range(nchannels)]
+    with wave.open(datapath, 'wb') as wav_file:
+        wav_file.setnchannels(nchannels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(fs)
+        for start in range(0, nsamples, chunk_size):
+            block = np.stack([next(source) for source in sources], axis = -1)[:nsamples - start]
+            wav_file.writeframes(np.clip(np.round(block*scale), -32768, 32767).astype('<i2').tobytes())
+
+    event_times = np.cumsum(rng.exponential(1/event_rate, int(2*duration*event_rate) + 10)) if (event_rate > 0) else np.zeros(0)
+    event_times = event_times[event_times < duration]
+    labels = rng.choice(list(event_labels), len(event_times))
+    eventspath = datapath[:-4] + '-events.txt'
+    with open(eventspath, 'w') as event_file:
+        event_file.write("# Marker IDs can be arbitrary strings.\n# Marker ID,\tTime (in s)\n")
+        event_file.writelines(f"{label},\t{event_time:.4f}\n" for label, event_time in zip(labels, event_times))
+    return datapath, eventspath
+
+"""Batch Processing"""
+
+#opens one recording and runs the recipe on it inside a worker process; failures are returned in the result row
+def _batch_worker(datapath, recipe, mmap):
+    row = {'datapath': datapath, 'ok': True, 'error': None}
+    try:
+        eventspath = datapath[:-4] + '-events.txt'
+        session = Session(datapath, 'y' if os.path.exists(eventspath) else '', mmap = mmap)
+        if not hasattr(session, '_channels'):
+            raise Exception(f"Could not read recording {datapath}")
+        row.update(recipe(session))
+    except Exception:
+        row['ok'] = False
+        row['error'] = traceback.format_exc()
+    return row
+
+def run_batch(source, recipe, processes = None, mmap = True, max_tasks_per_child = None, verbose = True):
+    '''
+    Process a folder of BYB recordings on a process pool.
+    Each recording is opened as a Session (with its "-events.txt" sidecar if it exists) and passed to recipe,
+    which returns a dictionary of results for that session, e.g. epochs, averages or spectra.
+
+    Keyword Arguments:
+    source -- directory of BYB_Recording_*.wav files, a glob pattern, or a list of WAV paths (string or list)
+    recipe -- function taking a Session and returning a dictionary of results (function). It is sent to the
+              worker processes, so it must be defined at module level.
+    processes -- number of worker processes (int). Default is the number of CPUs.
+    mmap -- if True, recordings are memory-mapped so each worker only holds the samples it touches (Boolean). Default value is True.
+    max_tasks_per_child -- if set, each worker process is replaced after this many recordings, returning its memory to the system (int)
+    verbose -- if True, prints progress and failures as recordings finish (Boolean). Default value is True.
+
+    Return:
+    list of result dictionaries, one per recording in sorted path order, each with the keys 'datapath', 'ok' and 'error'
+    (the traceback of a failed recording) plus the keys returned by recipe; it can be passed directly to pandas.DataFrame
+
+    Example: results = run_batch("recordings/", my_recipe, processes=8)
+    '''
+    if isinstance(source, str):
+        pattern = os.path.join(source, 'BYB_Recording_*.wav') if os.path.isdir(source) else source
+        datapaths = sorted(glob.glob(pattern))
+    else:
+        datapaths = sorted(source)
+    rows = [None]*len(datapaths)
+    pool_options = {} if max_tasks_per_child is None else {'max_tasks_per_child': max_tasks_per_child}
+    #concurrent.futures loads its process pool (and multiprocessing) only when ProcessPoolExecutor is first accessed
+    with concurrent.futures.ProcessPoolExecutor(max_workers = processes, **pool_options) as pool:
+        futures = {pool.submit(_batch_worker, datapath, recipe, mmap): i for i, datapath in enumerate(datapaths)}
+        for ndone, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            row = future.result()
+            rows[futures[future]] = row
+            if verbose:
+                print(f"[{ndone}/{len(datapaths)}] {row['datapath']}: {'done' if row['ok'] else 'failed'}")
+                if not row['ok']:
+                    print(row['error'])
+    return rows
@@ -0,0 +1,133 @@
+import numpy as np
+from scipy import signal
+
+import spikertools as st
+
+FS = 10000
+
+#the stream of simulated_source as one array, and the same samples as the list of blocks it yielded
+def stream(block_size, nblocks, seed = 0, **kwargs):
+    blocks = list(st.simulated_source(FS, block_size, nblocks, seed = seed, **kwargs))
+    return np.concatenate(blocks), blocks
+
+#sequential refractory period: a crossing is kept if it is at least refractory_samples after the last kept crossing
+def refractory_reference(crossings, refractory_samples):
+    kept = []
+    for crossing in crossings:
+        if not kept or (crossing - kept[-1] >= refractory_samples):
+            kept.append(crossing)
+    return np.array(kept, dtype = np.int64)
+
+#negative threshold crossings of the whole stream
+def crossings_reference(data, level):
+    above = data < level
+    return np.flatnonzero(above & ~np.concatenate(([False], above[:-1])))
+
+def test_ingest_matches_sosfilt_of_the_whole_stream():
+    data, blocks = stream(block_size = 256, nblocks = 40)
+    channel = st.OnlineChannel(FS, capacity = 10)
+    channel.filt(300, 'hp').filt(60, 'n').filt(3000, 'lp', 4)
+    for block in blocks:
+        channel.ingest(block)
+
+    sos = np.vstack([st.design_filter(300, 'hp', FS), st.design_filter(60, 'n', FS), st.design_filter(3000, 'lp', FS, 4)])
+    expected, _ = signal.sosfilt(sos, data, zi = signal.sosfilt_zi(sos)*data[0])
+    np.testing.assert_allclose(channel.get_data(), expected, rtol = 0, atol = 1e-12)
+
+def test_ingest_does_not_depend_on_block_sizes():
+    data, _ = stream(block_size = 5000, nblocks = 2)
+    whole = st.OnlineChannel(FS).filt(300, 'hp')
+    whole.ingest(data)
+    split = st.OnlineChannel(FS).filt(300, 'hp')
+    for block in np.split(data, [1, 7, 1000, 1001, 4093, 9000]):
+        split.ingest(block)
+    np.testing.assert_allclose(split.get_data(), whole.get_data(), rtol = 0, atol = 1e-12)
+
+def test_spikes_detected_across_block_boundaries():
+    data, blocks = stream(block_size = 333, nblocks = 60, spike_rate = 200)
+    channel = st.OnlineChannel(FS, capacity = 10).set_spike_detection(5, refractory = 0.001)
+    spikes = np.concatenate([channel.ingest(block) for block in blocks])
+
+    expected = refractory_reference(crossings_reference(data, -5), int(round(0.001*FS)))
+    assert len(expected) > 100
+    np.testing.assert_array_equal(np.round(spikes*FS).astype(np.int64), expected)
+    np.testing.assert_array_equal(channel.get_spike_times(), expected/FS)
+
+def test_refractory_period_is_relative_to_the_last_spike():
+    #negative pulses every 0.8 ms: with a 1 ms refractory period every other pulse is a spike
+    data = np.zeros(2000)
+    for onset in 100 + 8*np.arange(13):
+        data[onset:onset + 3] = -10
+    expected = 100 + 16*np.arange(7)
+
+    channel = st.OnlineChannel(FS).set_spike_detection(5, refractory = 0.001)
+    spikes = np.concatenate([channel.ingest(block) for block in np.array_split(data, 250)])
+    np.testing.assert_array_equal(np.round(spikes*FS).astype(np.int64), expected)
+
+    offline_times, _ = st.Channel(data, FS).detect_spikes(5, noise = 'std', refractory = 0.001, snippet = (0, 0.0001))
+    assert len(offline_times) == 7
+
+def test_ring_buffer_wraparound():
+    data, blocks = stream(block_size = 300, nblocks = 25)
+    ring = st.RingBuffer(1000)
+    written = 0
+    for block in blocks:
+        ring.write(block)
+        written = written + len(block)
+        np.testing.assert_array_equal(ring.get_data(), data[max(written - 1000, 0):written])
+        assert ring.get_count() == written
+        assert len(ring) == min(written, 1000)
+    #a block longer than the buffer keeps only its newest samples
+    ring.write(data[:2500])
+    np.testing.assert_array_equal(ring.get_data(), data[1500:2500])
+    assert ring.get_count() == written + 2500
+
+def test_online_channel_keeps_the_most_recent_samples():
+    data, blocks = stream(block_size = 400, nblocks = 30, spike_rate = 100)
+    channel = st.OnlineChannel(FS, capacity = 0.5).set_spike_detection(5)
+    for block in blocks:
+        channel.ingest(block)
+    capacity = int(0.5*FS)
+    np.testing.assert_array_equal(channel.get_data(), data[-capacity:])
+    np.testing.assert_allclose(channel.get_time()[:], np.arange(len(data) - capacity, len(data))/FS)
+    spike_times = channel.get_spike_times()
+    assert len(spike_times) > 0
+    assert np.all(spike_times >= (len(data) - capacity)/FS)
+
+def test_replacing_the_data_keeps_the_stream_position():
+    data, blocks = stream(block_size = 400, nblocks = 30, spike_rate = 100)
+    channel = st.OnlineChannel(FS, capacity = 0.5).set_spike_detection(5)
+    for block in blocks[:-1]:
+        channel.ingest(block)
+    spike_times = channel.get_spike_times()
+    start = channel.get_time()[0]
+    channel.normalize('mean')
+    assert channel.get_time()[0] == start
+    np.testing.assert_array_equal(channel.get_spike_times(), spike_times)
+    #blocks ingested afterwards carry on from the same sample count
+    channel.ingest(blocks[-1])
+    capacity = int(0.5*FS)
+    np.testing.assert_allclose(channel.get_time()[:], np.arange(len(data) - capacity, len(data))/FS)
+
+def test_channel_methods_use_stream_times():
+    data, blocks = stream(block_size = 400, nblocks = 30, spike_rate = 100)
+    channel = st.OnlineChannel(FS, capacity = 0.5)
+    for block in blocks:
+        channel.ingest(block)
+    lbound, rbound = (len(data) - 2000)/FS, (len(data) - 1000)/FS
+    assert np.isclose(channel.get_std([lbound, rbound]), np.std(data[len(data) - 2000:len(data) - 1000]))
+
+    times, _ = channel.detect_spikes(5, noise = 'std', snippet = (0, 0.0001))
+    offline_times, _ = st.Channel(channel.get_data(), FS).detect_spikes(5, noise = 'std', snippet = (0, 0.0001))
+    assert len(times) > 0
+    np.testing.assert_allclose(times, offline_times + channel.get_time()[0])
+
+def test_online_channel_cannot_be_resampled():
+    channel = st.OnlineChannel(FS)
+    channel.ingest(np.zeros(1000))
+    for resample in (lambda: channel.resample(FS/2), lambda: channel.decim(2)):
+        try:
+            resample()
+        except Exception:
+            continue
+        raise AssertionError("resampling an OnlineChannel should raise")
@@ -0,0 +1,107 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import spikertools as st
+
+#BYB recordings are 16-bit at 44.1 kHz
+FS = 44100
+
+#float32 results are compared with float64 results by their RMS error relative to the RMS of the float64 result
+#float32 rounding alone gives about 3e-8; filters and normalization are checked at 1e-6
+FILTER_TOLERANCE = 1e-6
+#decimation runs its FIR filter in the compute precision, which gives about 1.5e-7
+DECIM_TOLERANCE = 1e-6
+
+@pytest.fixture(scope = 'module')
+def recording():
+    rng = np.random.default_rng(0)
+    t = np.arange(5*FS)/FS
+    data = 3000*np.sin(2*np.pi*3*t) + 800*np.sin(2*np.pi*60*t) + 200*rng.standard_normal(len(t)) + 500
+    return data.astype(np.int16)
+
+def relative_error(result, reference):
+    result = np.asarray(result, dtype = np.float64)
+    return np.sqrt(np.mean((result - reference)**2))/np.sqrt(np.mean(reference**2))
+
+def session(data, dtype):
+    with contextlib.redirect_stdout(io.StringIO()):
+        session = st.Session(dtype = dtype)
+        session.set_channels([st.Channel(data.copy(), FS, dtype = dtype), st.Channel(data[::-1].copy(), FS, dtype = dtype)])
+        session.set_events({'1': np.array([0.5, 1.7, 3.2, 4.5])})
+    return session
+
+FILTERS = [
+    (0.5, 'hp', 2),
+    (1, 'hp', 2),
+    (10, 'lp', 4),
+    ([1, 10], 'bp', 4),
+    (60, 'n', 2),
+    (300, 'hp', 2),
+    (3000, 'lp', 2),
+    ([300, 3000], 'br', 4),
+]
+
+@pytest.mark.parametrize('chunk_size', [None, 10000])
+@pytest.mark.parametrize('cutoff, ftype, filter_order', FILTERS)
+def test_filt_float32_matches_float64(recording, cutoff, ftype, filter_order, chunk_size):
+    single = st.Channel(recording.copy(), FS, dtype = np.float32).filt(cutoff, ftype, filter_order, chunk_size = chunk_size).get_data()
+    double = st.Channel(recording.copy(), FS).filt(cutoff, ftype, filter_order).get_data()
+    assert single.dtype == np.float32
+    assert relative_error(single, double) < FILTER_TOLERANCE
+
+@pytest.mark.parametrize('chunk_size', [None, 10000])
+def test_session_filter_chain_float32_matches_float64(recording, chunk_size):
+    results = {}
+    for dtype in (np.float32, np.float64):
+        chained = session(recording, dtype)
+        chained.pipeline().filt(1, 'hp').filt(60, 'n').filt([1, 10], 'bp', 4).apply(chunk_size = chunk_size)
+        results[dtype] = chained.get_channeldata()
+    assert results[np.float32].dtype == np.float32
+    assert relative_error(results[np.float32], results[np.float64]) < FILTER_TOLERANCE
+
+def test_online_filter_float32_matches_float64(recording):
+    results = {}
+    for dtype in (np.float32, np.float64):
+        channel = st.OnlineChannel(FS, capacity = 5, dtype = dtype).filt(1, 'hp').filt([1, 10], 'bp', 4)
+        for block in np.array_split(recording, 37):
+            channel.ingest(block)
+        results[dtype] = channel.get_data()
+    assert results[np.float32].dtype == np.float32
+    assert relative_error(results[np.float32], results[np.float64]) < FILTER_TOLERANCE
+
+@pytest.mark.parametrize('decim_factor', [4, 2.5])
+def test_decim_float32_matches_float64(recording, decim_factor):
+    single = st.Channel(recording.copy(), FS, dtype = np.float32).decim(decim_factor).get_data()
+    double = st.Channel(recording.copy(), FS).decim(decim_factor).get_data()
+    assert single.dtype == np.float32
+    assert relative_error(single, double) < DECIM_TOLERANCE
+
+@pytest.mark.parametrize('norm_type', ['mean', 'std'])
+def test_normalize_float32_matches_float64(recording, norm_type):
+    single = st.Channel(recording.copy(), FS, dtype = np.float32).normalize(norm_type).get_data()
+    double = st.Channel(recording.copy(), FS).normalize(norm_type).get_data()
+    assert single.dtype == np.float32
+    assert relative_error(single, double) < FILTER_TOLERANCE
+
+def test_epochs_float32_matches_float64(recording):
+    epochs = {}
+    for dtype in (np.float32, np.float64):
+        filtered = session(recording, dtype)
+        filtered._filt(1, 'hp')
+        epochs[dtype] = filtered.epochs('1', 0.2, 0.3)
+    assert epochs[np.float32].dtype == np.float32
+    assert epochs[np.float32].shape == epochs[np.float64].shape == (4, 2, int(0.5*FS))
+    assert relative_error(epochs[np.float32], epochs[np.float64]) < FILTER_TOLERANCE
+
+def test_normalize_accepts_numpy_scalars(recording):
+    for dtype in (np.float32, np.float64):
+        scaled = session(recording, dtype)
+        norm_value = 1/np.max(np.abs(scaled.get_channeldata()))
+        assert isinstance(norm_value, np.generic)
+        scaled._normalize('scalar', norm_value, 0)
+        assert np.max(np.abs(scaled.get_channels()[0].get_data())) <= 1.0001
+        channel = st.Channel(recording.copy(), FS, dtype = dtype).normalize('scalar', np.float32(2))
+        np.testing.assert_allclose(channel.get_data(), 2*recording.astype(np.float64), rtol = 1e-6)
@@ -0,0 +1,46 @@
+import contextlib
+import io
+
+import numpy as np
+
+import spikertools as st
+
+FS = 10000
+
+def session():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((2, 5*FS))
+    with contextlib.redirect_stdout(io.StringIO()):
+        session = st.Session()
+        session.set_channels([st.Channel(data[0], FS, label = 'a'), st.Channel(data[1], FS, label = 'b')])
+        session.set_events({'1': np.array([0.5, 1.7, 3.2]), 'file': np.array([4.5])})
+    return session, data
+
+def test_save_open_round_trip(tmp_path):
+    saved, data = session()
+    saved.save(str(tmp_path))
+    for mmap in (True, False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            opened = st.Session.open(str(tmp_path), mmap = mmap)
+        np.testing.assert_array_equal(opened.get_channeldata(), data)
+        assert [chan.get_label() for chan in opened.get_channels()] == ['a', 'b']
+        assert [chan.get_fs() for chan in opened.get_channels()] == [FS, FS]
+        assert set(opened.get_events()) == {'1', 'file'}
+        np.testing.assert_array_equal(opened.get_events()['1'], [0.5, 1.7, 3.2])
+
+def test_save_into_the_directory_it_was_opened_from(tmp_path):
+    saved, data = session()
+    saved.save(str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        opened = st.Session.open(str(tmp_path), mmap = True)
+        opened.set_sessionID('resaved')
+    opened.save(str(tmp_path))
+    #the memory-mapped data of the opened Session is still intact
+    np.testing.assert_array_equal(opened.get_channeldata(), data)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        reopened = st.Session.open(str(tmp_path))
+    np.testing.assert_array_equal(reopened.get_channeldata(), data)
+    assert reopened.get_sessionID() == 'resaved'
+    np.testing.assert_array_equal(reopened.get_events()['file'], [4.5])
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['channels.npy', 'events.npz', 'session.json']